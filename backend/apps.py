@@ -1,5 +1,36 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_migrate, post_save
 
 
 class BackendConfig(AppConfig):
     name = 'backend'
+
+    def ready(self):
+        from backend.cache import invalidate_categories, invalidate_products, invalidate_saved
+        from backend.facets import update_facet_index, update_saved_facets
+        from backend.models import Category, Parameter, Product, ProductParameter, Shop
+        from backend.offers import update_best_offers, update_saved_offers
+        from backend.search import create_search_index, update_search_index
+        from backend.signals import catalog_updated, categories_updated
+        from backend.suggest import update_saved_suggestions, update_suggest_categories, update_suggest_index
+        post_migrate.connect(create_search_index, sender=self)
+        catalog_updated.connect(update_search_index, dispatch_uid='backend.search')
+        catalog_updated.connect(update_facet_index, dispatch_uid='backend.facets')
+        catalog_updated.connect(invalidate_products, dispatch_uid='backend.cache')
+        catalog_updated.connect(update_best_offers, dispatch_uid='backend.offers')
+        catalog_updated.connect(update_suggest_index, dispatch_uid='backend.suggest')
+        categories_updated.connect(update_suggest_categories, dispatch_uid='backend.suggest')
+        categories_updated.connect(invalidate_categories, dispatch_uid='backend.cache')
+        for model in (Category, Parameter, Product, ProductParameter, Shop):
+            post_save.connect(invalidate_saved, sender=model, dispatch_uid=f'backend.cache.{model.__name__}')
+            post_delete.connect(invalidate_saved, sender=model, dispatch_uid=f'backend.cache.{model.__name__}')
+        for model in (Parameter, Product, ProductParameter):
+            uid = f'backend.facets.{model.__name__}'
+            post_save.connect(update_saved_facets, sender=model, dispatch_uid=uid)
+            post_delete.connect(update_saved_facets, sender=model, dispatch_uid=uid)
+        post_save.connect(update_saved_offers, sender=Product, dispatch_uid='backend.offers')
+        post_delete.connect(update_saved_offers, sender=Product, dispatch_uid='backend.offers')
+        for model in (Category, Product):
+            uid = f'backend.suggest.{model.__name__}'
+            post_save.connect(update_saved_suggestions, sender=model, dispatch_uid=uid)
+            post_delete.connect(update_saved_suggestions, sender=model, dispatch_uid=uid)
@@ -0,0 +1,247 @@
+import hashlib
+import threading
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+from backend.conditional import make_etag, not_modified, set_validators
+from backend.models import Category, Parameter, Product, ProductParameter, Shop
+
+VERSION_KEY = 'catalog:version:{}'
+RESPONSE_KEY = 'catalog:response:{}:{}:{}'
+STALE_KEY = 'catalog:stale:{}:{}'
+LOCK_KEY = 'catalog:lock:{}'
+
+# изменения этих полей товара не видны в ответах каталога
+HIDDEN_FIELDS = {'content_hash', 'external_id'}
+
+
+def _initial_version():
+    # после вытеснения счетчика из кеша версия начинается с нового значения,
+    # чтобы не совпасть с версиями ответов, которые еще лежат в кеше
+    return int(time.time() * 1000)
+
+
+def get_versions(scopes):
+    keys = [VERSION_KEY.format(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(scopes):
+    """
+    Делает недействительными все ответы, в ключе которых есть версии scopes: O(1) на область,
+    без перебора ключей кеша. Вызывается после фиксации транзакции, иначе параллельный запрос
+    успеет закешировать старые данные под новой версией
+    """
+    def bump():
+        for scope in set(scopes):
+            key = VERSION_KEY.format(scope)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, _initial_version(), timeout=None)
+    transaction.on_commit(bump)
+
+
+class KeyLocks:
+    """
+    Блокировки процесса по ключу кеша; блокировка удаляется, когда ее никто не ждет
+    """
+
+    def __init__(self):
+        self.guard = threading.Lock()
+        self.locks = {}
+
+    def acquire(self, key, timeout=-1):
+        with self.guard:
+            lock, users = self.locks.get(key) or (threading.Lock(), 0)
+            self.locks[key] = (lock, users + 1)
+        if lock.acquire(timeout=timeout):
+            return True
+        self._forget(key)
+        return False
+
+    def release(self, key):
+        self.locks[key][0].release()
+        self._forget(key)
+
+    def _forget(self, key):
+        with self.guard:
+            lock, users = self.locks[key]
+            if users > 1:
+                self.locks[key] = (lock, users - 1)
+            else:
+                del self.locks[key]
+
+
+key_locks = KeyLocks()
+
+
+def single_flight(key, compute, stale_key=None):
+    """
+    Значение из кеша, а при промахе - результат compute(), который сохраняется в кеш.
+    Пересчитывает только один запрос: потоки процесса ждут его на блокировке процесса,
+    другие процессы - на блокировке в общем кеше. Пока идет пересчет, ожидающие получают
+    прошлое значение по stale_key, если оно есть, иначе ждут не дольше CATALOG_CACHE_WAIT
+    и после этого считают сами. compute() возвращает None, если результат нельзя кешировать
+    """
+    data = cache.get(key)
+    if data is not None:
+        return data
+    wait = settings.CATALOG_CACHE_WAIT
+    if not key_locks.acquire(key, timeout=0):
+        data = _stale(stale_key)
+        if data is None and key_locks.acquire(key, timeout=wait):
+            key_locks.release(key)
+            data = cache.get(key)
+        return data if data is not None else _compute(key, compute, stale_key)
+    try:
+        data = cache.get(key)
+        if data is not None:
+            return data
+        lock_key, token = LOCK_KEY.format(key), uuid.uuid4().hex
+        if cache.add(lock_key, token, timeout=settings.CATALOG_CACHE_LOCK_TIMEOUT):
+            try:
+                return _compute(key, compute, stale_key)
+            finally:
+                if cache.get(lock_key) == token:
+                    cache.delete(lock_key)
+        data = _stale(stale_key)
+        if data is None:
+            data = _wait(key, lock_key, time.monotonic() + wait)
+        return data if data is not None else _compute(key, compute, stale_key)
+    finally:
+        key_locks.release(key)
+
+
+def _stale(stale_key):
+    return cache.get(stale_key) if stale_key else None
+
+
+def _wait(key, lock_key, deadline):
+    # ждем, пока другой процесс сохранит значение или снимет блокировку
+    while time.monotonic() < deadline:
+        time.sleep(settings.CATALOG_CACHE_POLL_INTERVAL)
+        data = cache.get(key)
+        if data is not None or cache.get(lock_key) is None:
+            return data
+    return None
+
+
+def _compute(key, compute, stale_key):
+    data = compute()
+    if data is not None:
+        cache.set(key, data, timeout=settings.CATALOG_CACHE_TIMEOUT)
+        if stale_key:
+            cache.set(stale_key, data, timeout=settings.CATALOG_CACHE_STALE_TIMEOUT)
+    return data
+
+
+def cached_response(method):
+    """
+    Кеширует успешный GET-ответ метода представления. Ключ содержит путь, параметры
+    запроса и версии областей из view.cache_scopes(request). Промахи пересчитываются
+    через single_flight: при одновременных запросах метод выполняется один раз.
+    Из тех же версий строится ETag, поэтому на If-None-Match ответ 304 отдается
+    без обращения к кешу ответов и к базе
+    """
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        query = '&'.join(f'{name}={value}' for name, value in sorted(request.query_params.lists()))
+        versions = '.'.join(str(version) for version in get_versions(self.cache_scopes(request)))
+        # ссылки next/previous в ответе абсолютные, поэтому хост и схема входят в ключ
+        digest = hashlib.sha1(f'{request.build_absolute_uri(request.path)}?{query}'.encode()).hexdigest()
+        etag = make_etag(self.basename, digest, versions)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
+        def compute():
+            nonlocal response
+            response = method(self, request, *args, **kwargs)
+            return (etag, response.data) if response.status_code == status.HTTP_200_OK else None
+
+        # ETag хранится вместе с телом: прошлая версия ответа, отданная во время пересчета,
+        # должна уйти со своим ETag, иначе клиент получит 304 на устаревшее тело
+        cached = single_flight(RESPONSE_KEY.format(self.basename, digest, versions), compute,
+                               STALE_KEY.format(self.basename, digest))
+        if cached is None:
+            return response
+        cached_etag, data = cached
+        return set_validators(response if response is not None else Response(data), cached_etag)
+    return wrapper
+
+
+class CachedCatalogMixin:
+    """
+    Кеш ответов list/retrieve каталога. cache_scope - область всего списка; если запрос
+    отфильтрован по shop или category, вместо нее в ключ входят версии этих магазина и
+    категории, и правки товаров других магазинов и категорий страницу не сбрасывают.
+    cache_name_scopes - области названий, которые выводятся в ответе (магазины, категории,
+    параметры): их версии входят в ключ всегда и меняются при переименовании
+    """
+    cache_scope = None
+    cache_name_scopes = ()
+    cache_filter_scopes = ()
+
+    def cache_scopes(self, request):
+        filters = [f'{name}:{request.query_params[name]}' for name in self.cache_filter_scopes
+                   if request.query_params.get(name, '').isdigit()]
+        return list(self.cache_name_scopes) + (filters or [self.cache_scope])
+
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+
+def invalidate_products(sender, product_ids, fields=None, category_ids=(), **kwargs):
+    """
+    Обработчик catalog_updated: новые версии общего списка товаров, их магазинов и категорий
+    """
+    if fields is not None and not set(fields) - HIDDEN_FIELDS:
+        return
+    scopes = ['products'] + [f'category:{category_id}' for category_id in category_ids]
+    for shop_id, category_id in Product.objects.filter(id__in=list(product_ids)).values_list(
+            'shop_id', 'category_id').distinct():
+        scopes += [f'shop:{shop_id}', f'category:{category_id}']
+    bump_versions(scopes)
+
+
+def invalidate_categories(sender, category_ids, **kwargs):
+    """
+    Обработчик categories_updated: версия categories входит и в ключ списка категорий, и в ключи товаров
+    """
+    bump_versions(['categories'] + [f'category:{category_id}' for category_id in category_ids])
+
+
+def invalidate_saved(sender, instance, **kwargs):
+    """
+    Обработчик post_save/post_delete для правок через API и админку. Названия категорий,
+    магазинов и параметров сбрасывают свои области, версии которых входят в ключ каждой
+    страницы товаров
+    """
+    if sender is Product:
+        bump_versions(['products', f'shop:{instance.shop_id}', f'category:{instance.category_id}'])
+    elif sender is ProductParameter:
+        invalidate_products(sender, [instance.product_id])
+    elif sender is Parameter:
+        bump_versions(['parameters'])
+    elif sender is Category:
+        invalidate_categories(sender, [instance.pk])
+    elif sender is Shop:
+        bump_versions(['shops', f'shop:{instance.pk}'])
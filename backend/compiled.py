@@ -0,0 +1,178 @@
+import copy
+from collections import defaultdict
+from functools import lru_cache, partial
+from operator import itemgetter
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from backend.pagination import ordering_columns
+
+# поля, у которых to_representation не меняет значение из .values()
+IDENTITY_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.BooleanField,
+                   serializers.PrimaryKeyRelatedField)
+
+
+class CompiledSerializer:
+    """
+    Быстрый режим только для чтения для ModelSerializer: разбор полей выполняется один раз
+    на класс сериализатора, а строки собираются в словари из .values() без создания
+    экземпляров моделей и без обхода полей DRF на каждой строке. Результат совпадает с
+    Serializer(many=True).data.
+
+    Поддерживаются обычные поля модели (в том числе source через точку), StringRelatedField,
+    PrimaryKeyRelatedField, вложенный ModelSerializer по внешнему ключу и вложенный
+    ModelSerializer(many=True) по обратной связи
+    """
+
+    def __init__(self, serializer_class):
+        serializer = serializer_class()
+        self.model = serializer.Meta.model
+        self.pk = self.model._meta.pk.attname
+        self.columns = [self.pk]
+        # поля в порядке сериализатора: (ключ в ответе, вид, колонка .values(), преобразование или загрузчик)
+        self.fields = []
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            column = field.source.replace('.', '__')
+            if isinstance(field, serializers.ListSerializer) and isinstance(field.child, serializers.ModelSerializer):
+                self.fields.append((name, 'children', self.pk,
+                                    self._child_loader(field.source, compile_serializer(type(field.child)))))
+                continue
+            if column not in self.columns:
+                self.columns.append(column)
+            if isinstance(field, serializers.ModelSerializer):
+                self.fields.append((name, 'related', column, compile_serializer(type(field)).by_pk))
+            elif isinstance(field, serializers.StringRelatedField):
+                self.fields.append((name, 'related', column, self._string_loader(field.source)))
+            elif isinstance(field, (serializers.ManyRelatedField, serializers.SerializerMethodField,
+                                    serializers.Serializer)):
+                raise ImproperlyConfigured(f'{serializer_class.__name__}.{name} cannot be compiled')
+            elif isinstance(field, IDENTITY_FIELDS):
+                self.fields.append((name, 'plain', column, itemgetter(column)))
+            else:
+                self.fields.append((name, 'plain', column, self._converter(column, field.to_representation)))
+
+    @staticmethod
+    def _converter(column, to_representation):
+        def convert(row):
+            value = row[column]
+            return None if value is None else to_representation(value)
+        return convert
+
+    def _string_loader(self, source):
+        related_model = self.model._meta.get_field(source).related_model
+
+        def load(ids):
+            return {pk: str(instance) for pk, instance in related_model.objects.in_bulk(ids).items()}
+        return load
+
+    def _child_loader(self, source, child):
+        relation = self.model._meta.get_field(source)
+        foreign_key = relation.field.name
+
+        def load(ids):
+            rows = defaultdict(list)
+            queryset = relation.related_model.objects.filter(**{f'{foreign_key}__in': ids})
+            for row in queryset.order_by(child.pk).values(foreign_key, *child.columns):
+                rows[row[foreign_key]].append(row)
+            return {pk: child.serialize(items) for pk, items in rows.items()}
+        return load
+
+    def by_pk(self, ids):
+        rows = self.model.objects.filter(pk__in=ids).values(*self.columns)
+        return {row[self.pk]: item for row, item in zip(*self._pairs(rows))}
+
+    def project(self, fields=None, exclude=None):
+        """
+        Копия, которая выводит только поля fields (или все, кроме exclude). В .values()
+        остаются колонки выбранных полей, связанные объекты загружаются только для них
+        """
+        names = [name for name, *_ in self.fields]
+        unknown = [name for name in (fields or ()) + (exclude or ()) if name not in names]
+        if unknown:
+            raise ValidationError({'fields': f'Unknown fields: {", ".join(unknown)}'})
+        keep = [name for name in names if (fields is None or name in fields) and name not in (exclude or ())]
+        return _project(self, tuple(keep))
+
+    def values(self, queryset, extra=()):
+        """
+        queryset.values() с колонками, нужными сериализатору, и дополнительными колонками extra
+        """
+        columns = self.columns + [column for column in extra if column not in self.columns]
+        return queryset.prefetch_related(None).values(*columns)
+
+    def serialize(self, rows):
+        """
+        Список словарей в порядке полей сериализатора для строк из values()
+        """
+        return self._pairs(rows)[1]
+
+    def _pairs(self, rows):
+        rows = list(rows)
+        getters = []
+        for name, kind, column, accessor in self.fields:
+            if kind == 'plain':
+                getters.append((name, accessor))
+                continue
+            # связанные объекты загружаются одним запросом на поле для всей страницы
+            ids = {row[column] for row in rows if row[column] is not None}
+            loaded = accessor(ids) if ids else {}
+            default = [] if kind == 'children' else None
+            getters.append((name, partial(_lookup, loaded, column, default)))
+        return rows, [{name: get(row) for name, get in getters} for row in rows]
+
+
+def _lookup(loaded, column, default, row):
+    return loaded.get(row[column], default)
+
+
+@lru_cache(maxsize=None)
+def compile_serializer(serializer_class):
+    return CompiledSerializer(serializer_class)
+
+
+@lru_cache(maxsize=256)
+def _project(compiled, names):
+    projected = copy.copy(compiled)
+    projected.fields = [field for field in compiled.fields if field[0] in names]
+    projected.columns = [compiled.pk] + [column for name, kind, column, _ in projected.fields
+                                         if kind != 'children' and column != compiled.pk]
+    return projected
+
+
+def _names(request, param):
+    values = request.query_params.getlist(param)
+    if not values:
+        return None
+    return tuple(name.strip() for value in values for name in value.split(',') if name.strip()) or None
+
+
+def project_for_request(compiled, request):
+    """
+    Разреженный набор полей по параметрам ?fields=name,price и ?exclude=parameter
+    """
+    fields, exclude = _names(request, 'fields'), _names(request, 'exclude')
+    if fields is None and exclude is None:
+        return compiled
+    return compiled.project(fields, exclude)
+
+
+class CompiledListMixin:
+    """
+    list() представления через CompiledSerializer: страница выбирается из .values(),
+    ответ тот же, что у ListModelMixin. Параметры ?fields= и ?exclude= сокращают и ответ,
+    и колонки запроса: без вложенных полей их объекты не загружаются
+    """
+
+    def list(self, request, *args, **kwargs):
+        compiled = project_for_request(compile_serializer(self.get_serializer_class()), request)
+        queryset = compiled.values(self.filter_queryset(self.get_queryset()), ordering_columns(self))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(compiled.serialize(page))
+        return Response(compiled.serialize(queryset))
@@ -0,0 +1,26 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    """
+    Сильный ETag из версий и отметок времени данных, а не из тела ответа
+    """
+    return '"{}"'.format(hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest())
+
+
+def not_modified(request, etag, last_modified=None):
+    """
+    Ответ 304, если копия клиента актуальна по If-None-Match или If-Modified-Since,
+    иначе None. Проверяется до сериализации ответа
+    """
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
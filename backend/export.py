@@ -0,0 +1,75 @@
+import csv
+import json
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+
+from backend.models import Parameter, ProductParameter
+
+# колонки выгрузки: ключ в выгрузке -> поле .values()
+EXPORT_COLUMNS = {
+    'id': 'id',
+    'external_id': 'external_id',
+    'name': 'name',
+    'model': 'model',
+    'category_id': 'category_id',
+    'category': 'category__name',
+    'shop_id': 'shop_id',
+    'shop': 'shop__name',
+    'price': 'price',
+    'price_rrc': 'price_rrc',
+    'quantity': 'quantity',
+}
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def export_rows(queryset, chunk_size=None):
+    """
+    Товары словарями с параметрами {название: значение}. Товары читаются курсором
+    на стороне сервера (iterator), параметры - одним запросом на пакет из chunk_size
+    товаров, поэтому память не зависит от размера каталога
+    """
+    chunk_size = chunk_size or settings.CATALOG_EXPORT_CHUNK_SIZE
+    rows = queryset.order_by('id').values(*EXPORT_COLUMNS.values()).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        parameters = defaultdict(dict)
+        for product_id, name, value in ProductParameter.objects.filter(
+                product_id__in=[row['id'] for row in chunk]).order_by('id').values_list(
+                'product_id', 'parameter__name', 'value'):
+            parameters[product_id][name] = value
+        for row in chunk:
+            item = {key: row[column] for key, column in EXPORT_COLUMNS.items()}
+            item['parameters'] = parameters[row['id']]
+            yield item
+
+
+def export_ndjson(queryset, chunk_size=None):
+    for item in export_rows(queryset, chunk_size):
+        yield json.dumps(item, ensure_ascii=False) + '\n'
+
+
+class _Line:
+    # csv.writer пишет строку в буфер, а нам нужна сама строка
+    def write(self, value):
+        return value
+
+
+def export_csv(queryset, chunk_size=None):
+    """
+    CSV с колонкой на каждый параметр, встречающийся у выгружаемых товаров
+    """
+    names = list(Parameter.objects.filter(product_parameters__product__in=queryset.order_by().values('id'))
+                 .order_by('name').values_list('name', flat=True).distinct())
+    writer = csv.writer(_Line())
+    yield writer.writerow(list(EXPORT_COLUMNS) + names)
+    for item in export_rows(queryset, chunk_size):
+        parameters = item.pop('parameters')
+        yield writer.writerow(list(item.values()) + [parameters.get(name, '') for name in names])
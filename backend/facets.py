@@ -0,0 +1,282 @@
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from backend.models import Parameter, Product, ProductParameter
+
+# изменения этих полей меняют состав фасетов
+FACET_FIELDS = {'category_id', 'shop_id', 'parameters'}
+
+LOG_SEQUENCE_KEY = 'facets:sequence'
+LOG_ENTRY_KEY = 'facets:log:{}'
+
+
+class IntBitMap:
+    """
+    Битовое множество id на длинном целом Python - запасной вариант, если не установлен pyroaring.
+    Поддерживает только те операции BitMap, которые нужны FacetIndex
+    """
+    __slots__ = ('bits',)
+
+    def __init__(self, values=(), bits=0):
+        self.bits = bits | self._mask(values)
+
+    @staticmethod
+    def _mask(values):
+        values = list(values)
+        if not values:
+            return 0
+        # собираем маску в bytearray: побитовое ИЛИ по одному id копировало бы целое на каждом шаге
+        buffer = bytearray(max(values) // 8 + 1)
+        for value in values:
+            buffer[value >> 3] |= 1 << (value & 7)
+        return int.from_bytes(buffer, 'little')
+
+    def update(self, values):
+        self.bits |= self._mask(values)
+
+    def difference_update(self, other):
+        self.bits &= ~other.bits
+
+    def intersection_cardinality(self, other):
+        return _bit_count(self.bits & other.bits)
+
+    def __and__(self, other):
+        return IntBitMap(bits=self.bits & other.bits)
+
+    def __or__(self, other):
+        return IntBitMap(bits=self.bits | other.bits)
+
+    def __len__(self):
+        return _bit_count(self.bits)
+
+    def __iter__(self):
+        data = self.bits.to_bytes((self.bits.bit_length() + 7) // 8, 'little')
+        for index, byte in enumerate(data):
+            while byte:
+                lowest = byte & -byte
+                yield index * 8 + lowest.bit_length() - 1
+                byte ^= lowest
+
+
+def _bit_count(value):
+    return value.bit_count() if hasattr(value, 'bit_count') else bin(value).count('1')
+
+
+try:
+    # сжатые битовые карты Roaring, если установлен pyroaring
+    from pyroaring import BitMap
+except ImportError:
+    BitMap = IntBitMap
+
+
+class FacetIndex:
+    """
+    Фасетный индекс каталога в памяти процесса: битовая карта id товаров на каждую
+    пару (параметр, значение), категорию и магазин. Отбор товаров и подсчет фасетов
+    выполняются пересечением карт без обращения к базе.
+
+    Изменения каталога записываются в журнал в кеше Django (catalog_updated),
+    и каждый процесс перед запросом дочитывает журнал и обновляет только
+    затронутые товары; если журнал потерян или слишком длинный, индекс
+    строится заново
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        self.built = False
+        self.sequence = 0
+        self.products = BitMap()
+        self.categories = {}
+        self.shops = {}
+        self.parameters = defaultdict(dict)
+
+    def rebuild(self):
+        with self.lock:
+            self.reset()
+            self.sequence = cache.get(LOG_SEQUENCE_KEY, 0)
+            self._load(Product.objects.all(), ProductParameter.objects.all())
+            self.built = True
+
+    def refresh(self, product_ids):
+        """
+        Перечитывает из базы указанные товары, удаленные товары исключаются из индекса
+        """
+        with self.lock:
+            removed = BitMap(product_ids)
+            for bitmaps in (self.categories, self.shops, *self.parameters.values()):
+                for key, bitmap in list(bitmaps.items()):
+                    if bitmap.intersection_cardinality(removed):
+                        bitmap.difference_update(removed)
+                        if not len(bitmap):
+                            del bitmaps[key]
+            self.products.difference_update(removed)
+            for name in [name for name, values in self.parameters.items() if not values]:
+                del self.parameters[name]
+            self._load(Product.objects.filter(id__in=list(removed)),
+                       ProductParameter.objects.filter(product_id__in=list(removed)))
+
+    def ensure_current(self):
+        """
+        Применяет изменения из журнала, записанные после последнего обновления индекса
+        """
+        with self.lock:
+            if not self.built:
+                return self.rebuild()
+            sequence = cache.get(LOG_SEQUENCE_KEY, 0)
+            if sequence == self.sequence:
+                return
+            if not 0 < sequence - self.sequence <= settings.FACET_LOG_MAX_ENTRIES:
+                return self.rebuild()
+            keys = [LOG_ENTRY_KEY.format(number) for number in range(self.sequence + 1, sequence + 1)]
+            entries = cache.get_many(keys)
+            if len(entries) != len(keys):
+                return self.rebuild()
+            self.refresh({product_id for entry in entries.values() for product_id in entry})
+            self.sequence = sequence
+
+    def product_ids(self, category=None, shop=None, parameters=None, max_count=None):
+        """
+        id товаров, подходящих под фильтры, по возрастанию; None, если их больше max_count
+        """
+        with self.lock:
+            self.ensure_current()
+            selected = self._select(category, shop, parameters)
+            if max_count is not None and len(selected) > max_count:
+                return None
+            return list(selected)
+
+    def facets(self, category=None, shop=None, parameters=None):
+        """
+        Количество подходящих товаров и счетчики значений каждого параметра. Для параметра,
+        по которому уже выбран фильтр, счет ведется без учета этого фильтра, чтобы были видны альтернативы
+        """
+        parameters = parameters or {}
+        with self.lock:
+            self.ensure_current()
+            counts = {}
+            for name, values in self.parameters.items():
+                selected = self._select(category, shop, parameters, exclude=name)
+                value_counts = {value: bitmap.intersection_cardinality(selected) for value, bitmap in values.items()}
+                value_counts = {value: count for value, count in value_counts.items() if count}
+                if value_counts:
+                    counts[name] = value_counts
+            return len(self._select(category, shop, parameters)), counts
+
+    def _select(self, category=None, shop=None, parameters=None, exclude=None):
+        # значения одного параметра объединяются по ИЛИ, разные параметры - по И
+        result = self.products
+        if category is not None:
+            result = result & self.categories.get(category, BitMap())
+        if shop is not None:
+            result = result & self.shops.get(shop, BitMap())
+        for name, values in (parameters or {}).items():
+            if name == exclude:
+                continue
+            selected = BitMap()
+            for value in values:
+                selected = selected | self.parameters.get(name, {}).get(value, BitMap())
+            result = result & selected
+        return result
+
+    def _load(self, products, product_parameters):
+        product_ids, categories, shops, parameters = [], defaultdict(list), defaultdict(list), defaultdict(list)
+        for product_id, category_id, shop_id in products.values_list('id', 'category_id', 'shop_id').iterator():
+            product_ids.append(product_id)
+            categories[category_id].append(product_id)
+            shops[shop_id].append(product_id)
+        for product_id, name, value in product_parameters.values_list(
+                'product_id', 'parameter__name', 'value').iterator():
+            parameters[name, value].append(product_id)
+
+        self.products.update(product_ids)
+        for bitmaps, grouped in ((self.categories, categories), (self.shops, shops)):
+            for key, ids in grouped.items():
+                _add(bitmaps, key, ids)
+        for (name, value), ids in parameters.items():
+            _add(self.parameters[name], value, ids)
+
+
+def _add(bitmaps, key, product_ids):
+    if key in bitmaps:
+        bitmaps[key].update(product_ids)
+    else:
+        bitmaps[key] = BitMap(product_ids)
+
+
+facet_index = FacetIndex()
+
+
+def log_catalog_change(product_ids):
+    """
+    Добавляет id измененных товаров в журнал фасетного индекса
+    """
+    cache.add(LOG_SEQUENCE_KEY, 0, timeout=None)
+    sequence = cache.incr(LOG_SEQUENCE_KEY)
+    cache.set(LOG_ENTRY_KEY.format(sequence), list(product_ids), timeout=settings.FACET_LOG_TIMEOUT)
+
+
+def request_rebuild():
+    """
+    Занимает номер в журнале без записи: процессы, дочитывающие журнал, строят индекс заново
+    """
+    cache.add(LOG_SEQUENCE_KEY, 0, timeout=None)
+    cache.incr(LOG_SEQUENCE_KEY)
+
+
+def update_facet_index(sender, product_ids, fields=None, **kwargs):
+    """
+    Обработчик catalog_updated: изменения попадают в журнал после фиксации транзакции
+    """
+    if fields is None or FACET_FIELDS & set(fields):
+        product_ids = list(product_ids)
+        transaction.on_commit(lambda: log_catalog_change(product_ids))
+
+
+def update_saved_facets(sender, instance, **kwargs):
+    """
+    Обработчик post_save/post_delete товаров, их параметров и названий параметров для правок через API и админку
+    """
+    if sender is Parameter:
+        # карты хранятся по названию параметра, переименование затрагивает все товары с ним
+        transaction.on_commit(request_rebuild)
+        return
+    product_ids = [instance.pk if sender is Product else instance.product_id]
+    transaction.on_commit(lambda: log_catalog_change(product_ids))
+
+
+def filter_by_parameters(queryset, parameters):
+    """
+    Отбор товаров по фасетному индексу. Короткий список id передается в запрос через IN;
+    если подходящих товаров больше FACET_FILTER_MAX_IDS, такой список попал бы в запрос
+    дважды (COUNT и страница) и мог превысить лимит переменных SQL, поэтому условие
+    строится подзапросом по индексированной таблице параметров
+    """
+    product_ids = facet_index.product_ids(parameters=parameters, max_count=settings.FACET_FILTER_MAX_IDS)
+    if product_ids is not None:
+        return queryset.filter(id__in=product_ids)
+    # значения одного параметра объединяются по ИЛИ, разные параметры - по И, как в индексе
+    for name, values in parameters.items():
+        queryset = queryset.filter(id__in=ProductParameter.objects.filter(
+            parameter__name=name, value__in=values).values('product_id'))
+    return queryset
+
+
+def parse_parameter_filters(values):
+    """
+    Фильтры вида ?parameter=Цвет:черный&parameter=Цвет:синий -> {'Цвет': ['черный', 'синий']}
+    """
+    parameters = defaultdict(list)
+    for item in values:
+        name, separator, value = item.partition(':')
+        if not separator or not name.strip():
+            raise ValidationError({'parameter': f'Expected "name:value", got {item!r}'})
+        parameters[name.strip()].append(value.strip())
+    return dict(parameters)
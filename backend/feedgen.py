@@ -0,0 +1,109 @@
+import csv
+import json
+
+from backend.feeds import CsvFeedReader
+
+# идентификаторы категорий синтетического прайса не пересекаются с реальными
+CATEGORY_BASE_ID = 1000000
+
+SIZE_SUFFIXES = {'k': 1000, 'm': 1000000}
+
+
+def parse_size(value):
+    """
+    Количество товаров из строки вида 1000, 10k или 1M
+    """
+    value = str(value).strip().lower()
+    multiplier = SIZE_SUFFIXES.get(value[-1:], 1)
+    number = value[:-1] if value[-1:] in SIZE_SUFFIXES else value
+    if not number.isdigit():
+        raise ValueError(f'Invalid size {value!r}')
+    return int(number) * multiplier
+
+
+def synthetic_feed(goods, parameters=4, categories=10, shop='Синтетический магазин'):
+    """
+    Заголовок и генератор товаров синтетического прайса в схеме data/shop1.yaml
+    """
+    header = {
+        'shop': shop,
+        'categories': [{'id': CATEGORY_BASE_ID + number, 'name': f'Категория {number}'}
+                       for number in range(categories)],
+    }
+
+    def items():
+        for number in range(goods):
+            price = 1000 + number * 37 % 100000
+            yield {
+                'id': number + 1,
+                'category': CATEGORY_BASE_ID + number % categories,
+                'model': f'synthetic/model-{number % 1000}',
+                'name': f'Товар {number}',
+                'price': price,
+                'price_rrc': price + price // 10,
+                'quantity': number % 50,
+                'parameters': {
+                    f'Параметр {index}': number * (index + 1) % 512 if index % 2 == 0 else f'значение {number % 17}'
+                    for index in range(parameters)
+                },
+            }
+    return header, items()
+
+
+def _quote(value):
+    return json.dumps(value, ensure_ascii=False) if isinstance(value, str) else value
+
+
+def write_yaml(fp, header, goods):
+    fp.write(f'shop: {_quote(header["shop"])}\ncategories:\n')
+    for category in header['categories']:
+        fp.write(f'  - id: {category["id"]}\n    name: {_quote(category["name"])}\n')
+    fp.write('\ngoods:\n')
+    for item in goods:
+        fp.write(f'  - id: {item["id"]}\n')
+        for field in ('category', 'model', 'name', 'price', 'price_rrc', 'quantity'):
+            fp.write(f'    {field}: {_quote(item[field])}\n')
+        fp.write('    parameters:\n')
+        for name, value in item['parameters'].items():
+            fp.write(f'      {_quote(name)}: {_quote(value)}\n')
+
+
+def write_json(fp, header, goods):
+    fp.write(json.dumps(header, ensure_ascii=False)[:-1] + ', "goods": [\n')
+    for number, item in enumerate(goods):
+        fp.write((',\n' if number else '') + json.dumps(item, ensure_ascii=False))
+    fp.write('\n]}\n')
+
+
+def write_jsonl(fp, header, goods):
+    fp.write(json.dumps(header, ensure_ascii=False) + '\n')
+    for item in goods:
+        fp.write(json.dumps(item, ensure_ascii=False) + '\n')
+
+
+def write_csv(fp, header, goods):
+    category_names = {category['id']: category['name'] for category in header['categories']}
+    writer = None
+    for item in goods:
+        if writer is None:
+            writer = csv.writer(fp)
+            writer.writerow(CsvFeedReader.columns + tuple(item['parameters']))
+        writer.writerow([header['shop'], item['category'], category_names.get(item['category'], ''), item['id'],
+                         item['model'], item['name'], item['price'], item['price_rrc'], item['quantity'],
+                         *item['parameters'].values()])
+
+
+FEED_WRITERS = {
+    'yaml': write_yaml,
+    'json': write_json,
+    'jsonl': write_jsonl,
+    'csv': write_csv,
+}
+
+
+def write_feed(fp, feed_format, goods, parameters=4):
+    """
+    Пишет синтетический прайс в текстовый файл fp в формате feed_format
+    """
+    header, items = synthetic_feed(goods, parameters)
+    FEED_WRITERS[feed_format](fp, header, items)
@@ -0,0 +1,338 @@
+import csv
+import io
+import json
+import os
+import re
+from itertools import chain
+from urllib.parse import urlsplit
+
+from yaml import AliasEvent, MappingEndEvent, MappingStartEvent, ScalarEvent, ScalarNode, SequenceEndEvent, \
+    SequenceStartEvent, StreamEndEvent
+
+try:
+    # C-ускоренный разборщик libyaml, если PyYAML собран с ним
+    from yaml import CSafeLoader as FeedLoader
+except ImportError:
+    from yaml import SafeLoader as FeedLoader
+
+
+class FeedError(ValueError):
+    """
+    Некорректная структура прайса поставщика
+    """
+
+
+class YamlFeedReader:
+    """
+    Потоковое чтение прайса в формате data/shop1.yaml.
+
+    Заголовок (shop, categories) читается сразу, а последовательность goods
+    разбирается по событиям и отдается по одному товару, так что в памяти
+    никогда не строится весь документ целиком.
+    """
+
+    def __init__(self, stream):
+        self.loader = FeedLoader(stream)
+        self.header = {}
+        self._goods_pending = False
+        self._start()
+
+    def goods(self):
+        if not self._goods_pending:
+            return
+        self._goods_pending = False
+        loader = self.loader
+        while not loader.check_event(SequenceEndEvent):
+            item = self._build(loader.get_event(), {})
+            if not isinstance(item, dict):
+                raise FeedError('Each item of goods must be a mapping')
+            yield item
+        loader.get_event()
+        self._read_header()
+
+    def close(self):
+        self.loader.dispose()
+
+    def _start(self):
+        loader = self.loader
+        loader.get_event()  # StreamStartEvent
+        if loader.check_event(StreamEndEvent):
+            raise FeedError('Price list is empty')
+        loader.get_event()  # DocumentStartEvent
+        if not isinstance(loader.get_event(), MappingStartEvent):
+            raise FeedError('Price list must be a mapping')
+        self._read_header()
+
+    def _read_header(self):
+        # читаем ключи верхнего уровня до начала goods или до конца документа
+        loader = self.loader
+        while not loader.check_event(MappingEndEvent):
+            key = self._build(loader.get_event(), {})
+            if key == 'goods':
+                if loader.check_event(SequenceStartEvent):
+                    loader.get_event()
+                    self._goods_pending = True
+                    return
+                if self._build(loader.get_event(), {}) is not None:
+                    raise FeedError('goods must be a sequence')
+                continue
+            self.header[key] = self._build(loader.get_event(), {})
+        loader.get_event()
+
+    def _build(self, event, anchors):
+        loader = self.loader
+        if isinstance(event, ScalarEvent):
+            tag = event.tag
+            if tag is None or tag == '!':
+                tag = loader.resolve(ScalarNode, event.value, event.implicit)
+            value = loader.construct_document(ScalarNode(tag, event.value, event.start_mark, event.end_mark))
+        elif isinstance(event, SequenceStartEvent):
+            value = []
+            while not loader.check_event(SequenceEndEvent):
+                value.append(self._build(loader.get_event(), anchors))
+            loader.get_event()
+        elif isinstance(event, MappingStartEvent):
+            value = {}
+            while not loader.check_event(MappingEndEvent):
+                key = self._build(loader.get_event(), anchors)
+                value[key] = self._build(loader.get_event(), anchors)
+            loader.get_event()
+        elif isinstance(event, AliasEvent):
+            if event.anchor not in anchors:
+                raise FeedError(f'Unknown alias {event.anchor}')
+            return anchors[event.anchor]
+        else:
+            raise FeedError(f'Unexpected {event}')
+        if event.anchor is not None:
+            anchors[event.anchor] = value
+        return value
+
+
+class JsonFeedReader:
+    """
+    Потоковое чтение прайса в формате JSON с той же структурой, что и YAML:
+    {"shop": ..., "categories": [...], "goods": [...]}. Текст читается
+    блоками, каждый товар разбирается отдельно через JSONDecoder.raw_decode
+    """
+    buffer_size = 64 * 1024
+    whitespace = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, stream):
+        self.text = io.TextIOWrapper(stream, encoding='utf-8-sig')
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.header = {}
+        self._goods_pending = False
+        self._expect('{')
+        self._read_header()
+
+    def goods(self):
+        if not self._goods_pending:
+            return
+        self._goods_pending = False
+        while True:
+            char = self._peek()
+            if char == ']':
+                self.pos += 1
+                break
+            if char == ',':
+                self.pos += 1
+                continue
+            if not char:
+                raise FeedError('Unexpected end of price list')
+            item = self._value()
+            if not isinstance(item, dict):
+                raise FeedError('Each item of goods must be an object')
+            yield item
+        self._read_header()
+
+    def close(self):
+        self.text.detach()
+
+    def _read_header(self):
+        while True:
+            char = self._peek()
+            if char == '}':
+                self.pos += 1
+                return
+            if char == ',':
+                self.pos += 1
+                continue
+            if not char:
+                raise FeedError('Unexpected end of price list')
+            key = self._value()
+            self._expect(':')
+            if key == 'goods':
+                self._expect('[')
+                self._goods_pending = True
+                return
+            self.header[key] = self._value()
+
+    def _fill(self):
+        chunk = self.text.read(self.buffer_size)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def _peek(self):
+        while True:
+            self.pos = self.whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self._fill()
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise FeedError(f'Expected "{char}" in JSON price list')
+        self.pos += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as error:
+                if self.eof:
+                    raise FeedError(f'Invalid JSON price list: {error}') from error
+                self._fill()
+                continue
+            if end == len(self.buffer) and not self.eof:
+                # значение могло оборваться на границе блока, дочитываем и разбираем заново
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+
+class JsonLinesFeedReader:
+    """
+    Прайс в формате JSON Lines: первая строка - заголовок {"shop": ..., "categories": [...]},
+    каждая следующая строка - один товар
+    """
+
+    def __init__(self, stream):
+        self.lines = io.TextIOWrapper(stream, encoding='utf-8-sig')
+        self.line_number = 0
+        self.header = next(self._objects(), None) or {}
+        if 'goods' in self.header:
+            raise FeedError('JSON Lines header must not contain goods')
+
+    def goods(self):
+        return self._objects()
+
+    def close(self):
+        self.lines.detach()
+
+    def _objects(self):
+        for line in self.lines:
+            self.line_number += 1
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as error:
+                raise FeedError(f'Invalid JSON on line {self.line_number}: {error}') from error
+            if not isinstance(item, dict):
+                raise FeedError(f'Line {self.line_number} must be an object')
+            yield item
+
+
+class CsvFeedReader:
+    """
+    Прайс в формате CSV, одна строка на товар. Обязательные колонки: shop,
+    category, category_name, id, model, name, price, price_rrc, quantity;
+    остальные колонки считаются параметрами товара (пустые значения пропускаются).
+    Список категорий header['categories'] пополняется по мере чтения строк
+    """
+    columns = ('shop', 'category', 'category_name', 'id', 'model', 'name', 'price', 'price_rrc', 'quantity')
+    integer_columns = ('category', 'price', 'price_rrc', 'quantity')
+
+    def __init__(self, stream):
+        self.text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        first_line = self.text.readline()
+        delimiter = max(',;\t', key=first_line.count)
+        self.rows = csv.DictReader(chain([first_line], self.text), delimiter=delimiter)
+        missing = set(self.columns) - set(self.rows.fieldnames or ())
+        if missing:
+            raise FeedError(f'Missing CSV columns: {", ".join(sorted(missing))}')
+        self.parameters = [name for name in self.rows.fieldnames if name not in self.columns]
+        self.first_row = next(self.rows, None)
+        self.header = {'shop': self.first_row['shop'] if self.first_row else None, 'categories': []}
+        self.category_ids = set()
+
+    def goods(self):
+        if self.first_row is None:
+            return
+        for row in chain([self.first_row], self.rows):
+            yield self._good(row)
+
+    def close(self):
+        self.text.detach()
+
+    def _good(self, row):
+        good = {'id': row['id'], 'model': row['model'], 'name': row['name']}
+        try:
+            for column in self.integer_columns:
+                good[column] = int(row[column])
+        except (TypeError, ValueError) as error:
+            raise FeedError(f'Invalid number on line {self.rows.line_num}: {error}') from error
+        if good['category'] not in self.category_ids:
+            self.category_ids.add(good['category'])
+            self.header['categories'].append({'id': good['category'], 'name': row['category_name']})
+        good['parameters'] = {name: row[name] for name in self.parameters if row.get(name)}
+        return good
+
+
+FEED_READERS = {
+    'yaml': YamlFeedReader,
+    'json': JsonFeedReader,
+    'jsonl': JsonLinesFeedReader,
+    'csv': CsvFeedReader,
+}
+
+FEED_EXTENSIONS = {
+    '.yaml': 'yaml',
+    '.yml': 'yaml',
+    '.json': 'json',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.csv': 'csv',
+}
+
+
+def detect_format(stream, url=None):
+    """
+    Формат прайса по расширению файла в url, а если его нет - по первой строке файла
+    """
+    if url:
+        extension = os.path.splitext(urlsplit(url).path)[1].lower()
+        if extension in FEED_EXTENSIONS:
+            return FEED_EXTENSIONS[extension]
+    first_line, _, rest = stream.peek(64 * 1024).partition(b'\n')
+    first_line = first_line.decode('utf-8', 'ignore').lstrip('\ufeff').strip()
+    if first_line.startswith('{'):
+        # документ JSON, записанный в одну строку, тоже разбирается целиком: JSON Lines - это
+        # только законченный объект в первой строке, за которым идут следующие строки
+        try:
+            json.loads(first_line)
+        except ValueError:
+            return 'json'
+        return 'jsonl' if rest.strip() else 'json'
+    if ':' in first_line:
+        return 'yaml'
+    return 'csv'
+
+
+def open_feed(stream, feed_format=None, url=None):
+    """
+    Возвращает потоковый reader прайса с атрибутом header и генератором goods()
+    """
+    if not hasattr(stream, 'peek'):
+        stream = io.BufferedReader(stream)
+    feed_format = feed_format or detect_format(stream, url)
+    if feed_format not in FEED_READERS:
+        raise FeedError(f'Unsupported price list format: {feed_format}')
+    return FEED_READERS[feed_format](stream)
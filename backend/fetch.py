@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, zip_longest
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
+
+
+class FeedFetchError(Exception):
+    """
+    Прайс поставщика не удалось скачать
+    """
+
+
+_local = threading.local()
+
+
+def get_session():
+    """
+    Общая для потока сессия requests с пулом соединений к сайтам поставщиков
+    """
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = Session()
+        adapter = HTTPAdapter(pool_connections=settings.FEED_POOL_SIZE, pool_maxsize=settings.FEED_POOL_SIZE)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _local.session = session
+    return session
+
+
+class FeedCache:
+    """
+    Дисковый кеш последнего скачанного прайса для url: тело файла хранится
+    под именем из хешей url и содержимого, рядом лежат ETag/Last-Modified
+    и хеш последнего успешно импортированного файла
+    """
+
+    def __init__(self, url, directory=None):
+        self.url = url
+        self.directory = directory or settings.FEED_CACHE_DIR
+        self.key = hashlib.sha256(url.encode()).hexdigest()
+        self.meta_path = os.path.join(self.directory, f'{self.key}.json')
+        self.meta = self._load()
+
+    def _load(self):
+        try:
+            with open(self.meta_path) as meta_file:
+                return json.load(meta_file)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, **meta):
+        self.meta.update(meta)
+        with open(self.meta_path, 'w') as meta_file:
+            json.dump(self.meta, meta_file)
+
+    def body_path(self, content_hash):
+        return os.path.join(self.directory, f'{self.key}-{content_hash}.feed')
+
+    def conditional_headers(self):
+        content_hash = self.meta.get('content_hash')
+        if not content_hash or not os.path.exists(self.body_path(content_hash)):
+            return {}
+        headers = {}
+        if self.meta.get('etag'):
+            headers['If-None-Match'] = self.meta['etag']
+        if self.meta.get('last_modified'):
+            headers['If-Modified-Since'] = self.meta['last_modified']
+        return headers
+
+    def store(self, chunks, max_size):
+        """ сохраняет тело ответа во временный файл, считая размер и хеш на лету """
+        os.makedirs(self.directory, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as body:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if size > max_size:
+                        raise FeedFetchError(f'Price list is larger than {max_size} bytes')
+                    digest.update(chunk)
+                    body.write(chunk)
+            content_hash = digest.hexdigest()
+            os.replace(temp_path, self.body_path(content_hash))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return content_hash
+
+    def prune(self, keep=()):
+        """
+        удаляет тела прайсов этого url, кроме последнего скачанного и перечисленных в keep:
+        прежние файлы могут быть нужны импортам, стоящим в очереди
+        """
+        # метаданные перечитываем: прайс мог быть скачан заново в другом процессе
+        keep = {self._load().get('content_hash'), *keep}
+        prefix = f'{self.key}-'
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith('.feed') and name[len(prefix):-len('.feed')] not in keep:
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+
+class FetchedFeed:
+    """
+    Результат скачивания: путь к файлу в кеше и признак того, что содержимое
+    отличается от последнего успешно импортированного
+    """
+
+    def __init__(self, cache, content_hash):
+        self.cache = cache
+        self.content_hash = content_hash
+        self.path = cache.body_path(content_hash)
+        self.changed = content_hash != cache.meta.get('imported_hash')
+
+    def mark_imported(self):
+        self.cache.save(imported_hash=self.content_hash)
+
+
+def fetch_feed(url, session=None, cache_dir=None):
+    """
+    Скачивает прайс с учетом ETag/If-Modified-Since и кладет его в дисковый кеш
+    """
+    cache = FeedCache(url, cache_dir)
+    session = session or get_session()
+    headers = cache.conditional_headers()
+    try:
+        response = session.get(url, headers=headers, stream=True,
+                               timeout=(settings.FEED_CONNECT_TIMEOUT, settings.FEED_READ_TIMEOUT))
+    except RequestException as error:
+        raise FeedFetchError(f'Price list download failed: {error}') from error
+
+    with response:
+        if response.status_code == 304:
+            if not headers:
+                # без валидаторов 304 означает ошибку сайта: закешированного тела у нас нет
+                raise FeedFetchError('Price list download failed: HTTP 304 without a cached copy')
+            return FetchedFeed(cache, cache.meta['content_hash'])
+        if response.status_code != 200:
+            raise FeedFetchError(f'Price list download failed: HTTP {response.status_code}')
+        if int(response.headers.get('Content-Length') or 0) > settings.FEED_MAX_SIZE:
+            raise FeedFetchError(f'Price list is larger than {settings.FEED_MAX_SIZE} bytes')
+        try:
+            content_hash = cache.store(response.iter_content(chunk_size=64 * 1024), settings.FEED_MAX_SIZE)
+        except RequestException as error:
+            raise FeedFetchError(f'Price list download failed: {error}') from error
+
+    cache.save(content_hash=content_hash, etag=response.headers.get('ETag'),
+               last_modified=response.headers.get('Last-Modified'))
+    return FetchedFeed(cache, content_hash)
+
+
+def fetch_many(urls, max_workers=None, per_host=None, cache_dir=None):
+    """
+    Скачивает несколько прайсов параллельно в пуле потоков, не более per_host
+    одновременных запросов к одному сайту. Возвращает словарь url -> FetchedFeed
+    или FeedFetchError
+    """
+    max_workers = max_workers or settings.FEED_FETCH_WORKERS
+    per_host = per_host or settings.FEED_FETCH_PER_HOST
+    by_host = defaultdict(list)
+    for url in dict.fromkeys(urls):
+        by_host[urlsplit(url).hostname].append(url)
+    host_limits = {host: threading.BoundedSemaphore(per_host) for host in by_host}
+
+    def fetch(url):
+        with host_limits[urlsplit(url).hostname]:
+            try:
+                return fetch_feed(url, cache_dir=cache_dir)
+            except FeedFetchError as error:
+                return error
+
+    # чередуем сайты, чтобы потоки пула не простаивали в ожидании одного хоста
+    ordered = [url for url in chain.from_iterable(zip_longest(*by_host.values())) if url]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(ordered, executor.map(fetch, ordered)))
@@ -0,0 +1,45 @@
+from rest_framework.exceptions import ValidationError
+
+from backend.importer import NUMBER
+from backend.models import Parameter, ProductParameter
+
+
+def parse_range_filters(values):
+    """
+    Фильтры вида ?range=Диагональ (дюйм):6.0:6.5 или ?range=Встроенная память (Гб):256: ->
+    [('Диагональ (дюйм)', 6.0, 6.5), ('Встроенная память (Гб)', 256.0, None)]; пустая граница не ограничивает
+    """
+    ranges = []
+    for item in values:
+        parts = item.rsplit(':', 2)
+        if len(parts) != 3 or not parts[0].strip():
+            raise ValidationError({'range': f'Expected "name:min:max", got {item!r}'})
+        name, bounds = parts[0].strip(), []
+        for bound in parts[1:]:
+            bound = bound.strip()
+            if bound and not NUMBER.fullmatch(bound):
+                raise ValidationError({'range': f'{bound!r} is not a number'})
+            bounds.append(float(bound.replace(',', '.')) if bound else None)
+        ranges.append((name, *bounds))
+    return ranges
+
+
+def filter_parameter_ranges(queryset, ranges):
+    """
+    Отбирает товары, у которых числовое значение параметра попадает в диапазон.
+    Условие parameter_id = ... AND numeric_value BETWEEN ... выполняется по индексу
+    product_parameter_numeric_idx
+    """
+    if not ranges:
+        return queryset
+    parameter_ids = dict(Parameter.objects.filter(name__in={name for name, _, _ in ranges}).values_list('name', 'id'))
+    for name, minimum, maximum in ranges:
+        if name not in parameter_ids:
+            return queryset.none()
+        values = ProductParameter.objects.filter(parameter_id=parameter_ids[name], numeric_value__isnull=False)
+        if minimum is not None:
+            values = values.filter(numeric_value__gte=minimum)
+        if maximum is not None:
+            values = values.filter(numeric_value__lte=maximum)
+        queryset = queryset.filter(id__in=values.values('product_id'))
+    return queryset
@@ -0,0 +1,339 @@
+import hashlib
+import json
+import math
+import re
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from backend.feeds import FeedError, open_feed
+from backend.models import Category, Parameter, Product, ProductParameter, Shop
+from backend.offers import deferred_offers
+from backend.signals import catalog_updated, categories_updated
+
+PRODUCT_FIELDS = ('model', 'name', 'price', 'quantity', 'price_rrc', 'category_id', 'external_id', 'content_hash')
+
+NUMBER = re.compile(r'[+-]?\d+(?:[.,]\d+)?')
+
+
+def _empty_stats():
+    return {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+
+def good_hash(item):
+    """
+    Хеш содержимого товара из прайса: по нему повторный импорт пропускает неизмененные товары
+    """
+    content = json.dumps(item, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def validate_good(item):
+    """
+    Проверяет товар из прайса до записи в базу, чтобы ошибка указывала на конкретный товар
+    """
+    for field in ('category', 'price', 'price_rrc', 'quantity'):
+        value = item.get(field)
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise FeedError(f'Good {item.get("id")}: {field} must be a non-negative integer, got {value!r}')
+    for field, required in (('name', True), ('model', False)):
+        value = item.get(field)
+        if value is None and not required:
+            continue
+        if not isinstance(value, str) or len(value) > 80 or (required and not value):
+            raise FeedError(f'Good {item.get("id")}: invalid {field} {value!r}')
+    if not isinstance(item.get('parameters') or {}, dict):
+        raise FeedError(f'Good {item.get("id")}: parameters must be a mapping')
+
+
+def numeric_value(value):
+    """
+    Число из значения параметра (512, '6.5', '6,5') или None, если значение не числовое
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if math.isfinite(value) else None
+    value = str(value).strip()
+    return float(value.replace(',', '.')) if NUMBER.fullmatch(value) else None
+
+
+class ParameterCache:
+    """
+    Кеш соответствия имени параметра и его id в справочнике Parameter на время жизни процесса
+    """
+
+    def __init__(self):
+        self.ids = {}
+
+    def resolve(self, names):
+        missing = set(names) - self.ids.keys()
+        if missing:
+            Parameter.objects.bulk_create([Parameter(name=name) for name in missing], ignore_conflicts=True)
+            self.ids.update(Parameter.objects.filter(name__in=missing).values_list('name', 'id'))
+        return self.ids
+
+    def clear(self):
+        self.ids.clear()
+
+
+parameter_cache = ParameterCache()
+
+
+class PriceListImporter:
+    """
+    Загрузка прайса поставщика пакетами: категории, товары и параметры
+    записываются через bulk_create/bulk_update, по одной транзакции на пакет.
+
+    Товары с идентификатором id сравниваются с прошлым импортом по хешу
+    содержимого: неизмененные пропускаются без обращения к базе, а пропавшие
+    из прайса снимаются с продажи (quantity = 0).
+    """
+
+    def __init__(self, shop, chunk_size=None, progress=None):
+        self.shop = shop
+        self.chunk_size = chunk_size or settings.PARTNER_IMPORT_CHUNK_SIZE
+        self.progress = progress
+        self.rows_processed = 0
+        self.stats = {
+            'categories': _empty_stats(),
+            'products': {**_empty_stats(), 'withdrawn': 0},
+            'parameters': {**_empty_stats(), 'deleted': 0},
+        }
+        self.known_hashes = {}
+        self.seen_ids = set()
+
+    def run(self, categories, goods):
+        # лучшие предложения пересчитываются один раз после всего прайса, а не на каждый пакет
+        with deferred_offers():
+            return self._run(categories, goods)
+
+    def _run(self, categories, goods):
+        categories = categories if categories is not None else []
+        categories_imported = 0
+        self.known_hashes = dict(
+            Product.objects.filter(shop_id=self.shop.id).exclude(external_id='')
+            .values_list('external_id', 'content_hash')
+        )
+        goods = iter(goods or [])
+        while True:
+            chunk = list(islice(goods, self.chunk_size))
+            # в CSV категории узнаются вместе с товарами, поэтому список может пополняться по ходу чтения
+            if len(categories) > categories_imported:
+                self.import_categories(categories[categories_imported:])
+                categories_imported = len(categories)
+            if not chunk:
+                break
+            self.import_goods(chunk)
+            self.rows_processed += len(chunk)
+            if self.progress:
+                self.progress(self)
+        if not self.rows_processed and self.known_hashes:
+            # пустой список товаров - скорее обрезанный или неверно разобранный прайс, чем
+            # снятие с продажи всего каталога магазина
+            raise FeedError('Price list has no goods, the catalog of the shop is left as is')
+        self.withdraw_vanished()
+        return self.stats
+
+    @transaction.atomic
+    def import_categories(self, categories):
+        stats = self.stats['categories']
+        names = {category['id']: category.get('name') for category in categories}
+        existing = Category.objects.in_bulk(list(names))
+
+        to_create, to_update = [], []
+        for category_id, name in names.items():
+            category = existing.get(category_id)
+            if category is None:
+                to_create.append(Category(id=category_id, name=name))
+            elif category.name != name:
+                category.name = name
+                to_update.append(category)
+            else:
+                stats['unchanged'] += 1
+
+        Category.objects.bulk_create(to_create, batch_size=self.chunk_size, ignore_conflicts=True)
+        Category.objects.bulk_update(to_update, ['name'], batch_size=self.chunk_size)
+        stats['inserted'] += len(to_create)
+        stats['updated'] += len(to_update)
+        if to_create or to_update:
+            categories_updated.send(sender=self.__class__,
+                                    category_ids=[category.id for category in to_create + to_update])
+
+    def import_goods(self, goods):
+        items = {}
+        for item in goods:
+            validate_good(item)
+            external_id = str(item['id']) if item.get('id') is not None else ''
+            content_hash = good_hash(item)
+            if external_id:
+                self.seen_ids.add(external_id)
+                if self.known_hashes.get(external_id) == content_hash:
+                    self.stats['products']['unchanged'] += 1
+                    self.stats['parameters']['unchanged'] += len(item.get('parameters') or {})
+                    continue
+            # товары без id различаются по ограничению unique_product_info (name, shop, price)
+            key = external_id or (item.get('name'), item.get('price'))
+            items[key] = (external_id, content_hash, item)
+        if not items:
+            return
+
+        try:
+            with transaction.atomic():
+                products, moved_from, changed = self._upsert_products(items)
+                parameters_changed = self._upsert_parameters(products, items)
+                # обработчики получают только действительно измененные поля: смена цены не
+                # должна перестраивать поиск и подсказки по всему прайсу
+                by_fields = defaultdict(list)
+                for key in items:
+                    if key not in products:
+                        continue
+                    product_id, fields = products[key].id, changed.get(key, ())
+                    if fields is not None and product_id in parameters_changed:
+                        fields += ('parameters',)
+                    if fields != ():
+                        by_fields[fields].append(product_id)
+                for fields, product_ids in by_fields.items():
+                    catalog_updated.send(sender=self.__class__, product_ids=product_ids, fields=fields,
+                                         category_ids=moved_from if fields is None or 'category_id' in fields else ())
+        except Exception:
+            # параметры, созданные в откаченной транзакции, не должны остаться в кеше
+            parameter_cache.clear()
+            raise
+        for external_id, content_hash, _ in items.values():
+            if external_id:
+                self.known_hashes[external_id] = content_hash
+
+    @transaction.atomic
+    def withdraw_vanished(self):
+        vanished = [external_id for external_id in self.known_hashes if external_id not in self.seen_ids]
+        for start in range(0, len(vanished), self.chunk_size):
+            product_ids = list(Product.objects.filter(
+                shop_id=self.shop.id, external_id__in=vanished[start:start + self.chunk_size],
+            ).values_list('id', flat=True))
+            self.stats['products']['withdrawn'] += Product.objects.filter(id__in=product_ids).update(
+                quantity=0, content_hash='', updated_at=timezone.now())
+            catalog_updated.send(sender=self.__class__, product_ids=product_ids, fields=('quantity',))
+
+    def _product_map(self, items):
+        queryset = Product.objects.filter(shop_id=self.shop.id).only('id', *PRODUCT_FIELDS)
+        external_ids = [key for key in items if isinstance(key, str)]
+        products = {product.external_id: product for product in queryset.filter(external_id__in=external_ids)}
+
+        # товары, загруженные до появления external_id, ищем по названию и цене
+        missing = {(item.get('name'), item.get('price')): key
+                   for key, (_, _, item) in items.items() if key not in products}
+        if missing:
+            for product in queryset.filter(name__in={name for name, _ in missing}):
+                key = missing.get((product.name, product.price))
+                if key is not None and key not in products and product.external_id in ('', key):
+                    products[key] = product
+        return products
+
+    def _upsert_products(self, items):
+        stats = self.stats['products']
+        existing = self._product_map(items)
+
+        # changed - ключ товара -> измененные поля, None для нового товара
+        to_create, to_update, moved_from, changed = [], [], set(), {}
+        now = timezone.now()
+        for key, (external_id, content_hash, item) in items.items():
+            values = {
+                'model': item.get('model') or '',
+                'name': item.get('name'),
+                'price': item.get('price'),
+                'quantity': item.get('quantity'),
+                'price_rrc': item.get('price_rrc'),
+                'category_id': item.get('category'),
+                'external_id': external_id,
+                'content_hash': content_hash,
+            }
+            product = existing.get(key)
+            if product is None:
+                to_create.append(Product(shop_id=self.shop.id, **values))
+                changed[key] = None
+                continue
+            fields = tuple(field for field, value in values.items() if getattr(product, field) != value)
+            if fields:
+                if product.category_id != values['category_id']:
+                    moved_from.add(product.category_id)
+                for field in fields:
+                    setattr(product, field, values[field])
+                changed[key] = fields
+                # bulk_update не заполняет auto_now
+                product.updated_at = now
+                to_update.append(product)
+            else:
+                stats['unchanged'] += 1
+
+        Product.objects.bulk_create(to_create, batch_size=self.chunk_size, ignore_conflicts=True)
+        Product.objects.bulk_update(to_update, PRODUCT_FIELDS + ('updated_at',), batch_size=self.chunk_size)
+        stats['inserted'] += len(to_create)
+        stats['updated'] += len(to_update)
+
+        if to_create:
+            # при ignore_conflicts первичные ключи не возвращаются, перечитываем их одним запросом
+            existing = self._product_map(items)
+        return existing, moved_from, changed
+
+    def _upsert_parameters(self, products, items):
+        """ возвращает id товаров, параметры которых изменились """
+        stats = self.stats['parameters']
+        product_ids = {key: products[key].id for key in items if key in products}
+        existing = {
+            (parameter.product_id, parameter.parameter_id): parameter
+            for parameter in ProductParameter.objects.filter(product_id__in=product_ids.values())
+        }
+        parameter_ids = parameter_cache.resolve(
+            {name for _, _, item in items.values() for name in item.get('parameters') or {}}
+        )
+
+        to_create, to_update, incoming = [], [], set()
+        for key, (_, _, item) in items.items():
+            product_id = product_ids.get(key)
+            if product_id is None:
+                continue
+            for name, value in (item.get('parameters') or {}).items():
+                number = numeric_value(value)
+                value = str(value)
+                parameter_id = parameter_ids[name]
+                incoming.add((product_id, parameter_id))
+                parameter = existing.get((product_id, parameter_id))
+                if parameter is None:
+                    to_create.append(ProductParameter(product_id=product_id, parameter_id=parameter_id, value=value,
+                                                      numeric_value=number))
+                elif parameter.value != value or parameter.numeric_value != number:
+                    parameter.value = value
+                    parameter.numeric_value = number
+                    to_update.append(parameter)
+                else:
+                    stats['unchanged'] += 1
+
+        # параметры, исчезнувшие из описания товара в прайсе, удаляем
+        dropped = [parameter for pair, parameter in existing.items() if pair not in incoming]
+        if dropped:
+            stats['deleted'] += ProductParameter.objects.filter(
+                id__in=[parameter.id for parameter in dropped]).delete()[0]
+        ProductParameter.objects.bulk_create(to_create, batch_size=self.chunk_size, ignore_conflicts=True)
+        ProductParameter.objects.bulk_update(to_update, ['value', 'numeric_value'], batch_size=self.chunk_size)
+        stats['inserted'] += len(to_create)
+        stats['updated'] += len(to_update)
+        return {parameter.product_id for parameter in to_create + to_update + dropped}
+
+
+def import_feed(stream, user_id, chunk_size=None, progress=None, feed_format=None, url=None):
+    """
+    Потоковый импорт прайса: товары читаются из stream по одному и пишутся пакетами.
+    Формат (yaml, json, jsonl, csv) берется из feed_format или определяется по url и содержимому
+    """
+    reader = open_feed(stream, feed_format, url)
+    try:
+        if not reader.header.get('shop'):
+            raise FeedError('Shop name is not specified')
+        shop, _ = Shop.objects.get_or_create(name=reader.header['shop'], user_id=user_id)
+        return PriceListImporter(shop, chunk_size, progress).run(reader.header.get('categories'), reader.goods())
+    finally:
+        reader.close()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from backend.fetch import fetch_feed, fetch_many
+
+
+class SlowFeedHandler(BaseHTTPRequestHandler):
+    """
+    Медленный сайт поставщика: отвечает data/shop1.yaml с задержкой
+    """
+    delay = 0
+    body = b''
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает последовательное и параллельное скачивание прайсов с медленных локальных серверов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoints', type=int, default=50, help='количество прайсов')
+        parser.add_argument('--delay', type=float, default=0.2, help='задержка ответа сервера, секунд')
+        parser.add_argument('--hosts', type=int, default=5,
+                            help='количество серверов на адресах 127.0.0.1, 127.0.0.2, ...')
+        parser.add_argument('--workers', type=int, default=None)
+        parser.add_argument('--per-host', type=int, default=None)
+
+    def handle(self, *args, **options):
+        with open(os.path.join(settings.BASE_DIR, 'data', 'shop1.yaml'), 'rb') as data_shop:
+            SlowFeedHandler.body = data_shop.read()
+        SlowFeedHandler.delay = options['delay']
+
+        servers = [ThreadingHTTPServer((f'127.0.0.{host}', 0), SlowFeedHandler)
+                   for host in range(1, options['hosts'] + 1)]
+        for server in servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        urls = []
+        for number in range(options['endpoints']):
+            host, port = servers[number % len(servers)].server_address
+            urls.append(f'http://{host}:{port}/feed/{number}.yaml')
+
+        cache_dir = tempfile.mkdtemp()
+        try:
+            started = time.perf_counter()
+            for url in urls:
+                fetch_feed(url, cache_dir=os.path.join(cache_dir, 'sequential'))
+            sequential = time.perf_counter() - started
+
+            started = time.perf_counter()
+            fetch_many(urls, max_workers=options['workers'], per_host=options['per_host'],
+                       cache_dir=os.path.join(cache_dir, 'concurrent'))
+            concurrent = time.perf_counter() - started
+        finally:
+            shutil.rmtree(cache_dir)
+            for server in servers:
+                server.shutdown()
+                server.server_close()
+
+        self.stdout.write(f'{len(urls)} feeds, {options["delay"]}s delay, {len(servers)} hosts')
+        self.stdout.write(f'sequential: {sequential:.2f}s')
+        self.stdout.write(f'concurrent: {concurrent:.2f}s ({sequential / concurrent:.1f}x)')
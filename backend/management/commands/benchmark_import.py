@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from backend.feedgen import FEED_WRITERS, parse_size, synthetic_feed, write_feed
+from backend.feeds import open_feed
+from backend.importer import import_feed, validate_good
+from backend.models import Category, Shop, User
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время и пиковую память этапов импорта прайса (разбор, проверка, запись) ' \
+           'на синтетических прайсах разного размера. Для SQLite запускать с ORDERS_DB=sqlite'
+
+    def add_arguments(self, parser):
+        parser.add_argument('sizes', nargs='*', default=['1k', '10k'], help='размеры прайсов: 1k 10k 100k 1M')
+        parser.add_argument('--parameters', type=int, default=4, help='количество параметров у товара')
+        parser.add_argument('--format', dest='feed_format', choices=list(FEED_WRITERS), default='yaml')
+        parser.add_argument('--chunk-size', type=int, default=None)
+        parser.add_argument('--no-memory', action='store_true',
+                            help='не отслеживать память (tracemalloc замедляет замеры)')
+        parser.add_argument('--save', help='сохранить результаты в JSON-файл')
+        parser.add_argument('--baseline', help='JSON-файл с прошлыми результатами для сравнения')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [parse_size(size) for size in options['sizes']]
+        except ValueError as error:
+            raise CommandError(error)
+        baseline = {}
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        self.options = options
+        self.stdout.write(f'database: {connection.vendor}, format: {options["feed_format"]}, '
+                          f'parameters: {options["parameters"]}')
+        results = {}
+        directory = tempfile.mkdtemp()
+        try:
+            for goods in sizes:
+                path = os.path.join(directory, f'feed-{goods}.{options["feed_format"]}')
+                with open(path, 'w', encoding='utf-8', newline='') as fp:
+                    write_feed(fp, options['feed_format'], goods, options['parameters'])
+                results[str(goods)] = self.benchmark(path, goods)
+        finally:
+            shutil.rmtree(directory)
+
+        for goods, stages in results.items():
+            for stage, result in stages.items():
+                rate = int(goods) / result['seconds']
+                line = f'{goods:>8} {stage:<9} {result["seconds"]:8.2f}s {rate:>12,.0f} goods/s'
+                if result.get('peak_mb') is not None:
+                    line += f' {result["peak_mb"]:8.1f} MB peak'
+                previous = baseline.get(goods, {}).get(stage)
+                if previous:
+                    line += f' ({(result["seconds"] / previous["seconds"] - 1) * 100:+.0f}% vs baseline)'
+                self.stdout.write(line)
+
+        if options['save']:
+            with open(options['save'], 'w') as save_file:
+                json.dump(results, save_file, indent=2)
+
+    def measure(self, function):
+        if not self.options['no_memory']:
+            tracemalloc.start()
+        started = time.perf_counter()
+        function()
+        result = {'seconds': max(time.perf_counter() - started, 1e-9), 'peak_mb': None}
+        if not self.options['no_memory']:
+            result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            tracemalloc.stop()
+        return result
+
+    def read(self, path, validate=False):
+        validating = 0.0
+        with open(path, 'rb') as stream:
+            reader = open_feed(stream, self.options['feed_format'])
+            for good in reader.goods():
+                if validate:
+                    started = time.perf_counter()
+                    validate_good(good)
+                    validating += time.perf_counter() - started
+            reader.close()
+        return validating
+
+    def benchmark(self, path, goods):
+        stages = {'parse': self.measure(lambda: self.read(path))}
+        validating = []
+        stages['validate'] = self.measure(lambda: validating.append(self.read(path, validate=True)))
+        # в этап проверки идет только время validate_good, без повторного разбора
+        stages['validate']['seconds'] = max(validating[0], 1e-9)
+
+        user = User.objects.create_user(email=f'benchmark-{uuid.uuid4().hex}@example.com', type='shop')
+        try:
+            def write():
+                with open(path, 'rb') as stream:
+                    import_feed(stream, user.id, self.options['chunk_size'], feed_format=self.options['feed_format'])
+            stages['write'] = self.measure(write)
+            # повторный импорт того же прайса проходит только по хешам товаров
+            stages['reimport'] = self.measure(write)
+        finally:
+            header, _ = synthetic_feed(0, self.options['parameters'])
+            Shop.objects.filter(user=user).delete()
+            user.delete()
+            Category.objects.filter(id__in=[category['id'] for category in header['categories']]).delete()
+        return stages
@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from backend.feedgen import FEED_WRITERS, write_feed
+from backend.feeds import open_feed
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость потокового разбора прайса в форматах YAML, JSON, JSON Lines и CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--goods', type=int, default=100000, help='количество товаров в прайсе')
+        parser.add_argument('--parameters', type=int, default=4, help='количество параметров у товара')
+        parser.add_argument('--formats', nargs='+', choices=list(FEED_WRITERS), default=list(FEED_WRITERS))
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp()
+        try:
+            for feed_format in options['formats']:
+                path = os.path.join(directory, f'feed.{feed_format}')
+                with open(path, 'w', encoding='utf-8', newline='') as fp:
+                    write_feed(fp, feed_format, options['goods'], options['parameters'])
+
+                started = time.perf_counter()
+                with open(path, 'rb') as stream:
+                    reader = open_feed(stream, feed_format)
+                    count = sum(1 for _ in reader.goods())
+                    reader.close()
+                elapsed = time.perf_counter() - started
+
+                size = os.path.getsize(path) / 1024 / 1024
+                self.stdout.write(f'{feed_format:>6}: {count} goods, {size:.1f} MB, {elapsed:.2f}s, '
+                                  f'{count / elapsed:,.0f} goods/s, {size / elapsed:.1f} MB/s')
+        finally:
+            shutil.rmtree(directory)
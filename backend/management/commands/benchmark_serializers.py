@@ -0,0 +1,65 @@
+import io
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.compiled import compile_serializer
+from backend.feedgen import parse_size, synthetic_feed, write_feed
+from backend.importer import import_feed
+from backend.models import Category, Contact, Order, Product, Shop, User
+from backend.serializers import OrderSerializer, ProductSerializer
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает ModelSerializer и CompiledSerializer на страницах товаров и заказов разного размера ' \
+           '(время вместе с запросами к базе). Для SQLite запускать с ORDERS_DB=sqlite'
+
+    def add_arguments(self, parser):
+        parser.add_argument('sizes', nargs='*', default=['40', '1000', '10k'])
+        parser.add_argument('--repeat', type=int, default=3, help='лучший результат из нескольких повторов')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [parse_size(size) for size in options['sizes']]
+        except ValueError as error:
+            raise CommandError(error)
+        from backend.views import ProductViewSet
+
+        user = User.objects.create_user(email=f'benchmark-{uuid.uuid4().hex}@example.com', type='shop')
+        try:
+            feed = io.StringIO()
+            write_feed(feed, 'jsonl', max(sizes))
+            import_feed(io.BytesIO(feed.getvalue().encode()), user.id, feed_format='jsonl')
+            shop = Shop.objects.get(user=user)
+            contact = Contact.objects.create(user=user, type='phone', value='1', city='-', street='-', phone='-')
+            Order.objects.bulk_create(
+                Order(user=user, product_id=product_id, shop=shop, quantity=1, contact=contact, sum_price_product=1)
+                for product_id in Product.objects.filter(shop=shop).values_list('id', flat=True)
+            )
+            products = ProductViewSet.queryset.filter(shop=shop)
+            orders = Order.objects.filter(user=user)
+
+            self.stdout.write(f'{"rows":>8} {"serializer":<18} {"drf":>9} {"compiled":>9} {"speedup":>8}')
+            for size in sizes:
+                for serializer_class, queryset in ((ProductSerializer, products), (OrderSerializer, orders)):
+                    drf = self.best(lambda: serializer_class(queryset[:size], many=True).data, options['repeat'])
+                    compiled = compile_serializer(serializer_class)
+                    fast = self.best(lambda: compiled.serialize(compiled.values(queryset)[:size]), options['repeat'])
+                    self.stdout.write(f'{size:>8} {serializer_class.__name__:<18} {drf * 1000:>7.1f}ms '
+                                      f'{fast * 1000:>7.1f}ms {drf / fast:>7.1f}x')
+        finally:
+            header, _ = synthetic_feed(0)
+            Order.objects.filter(user=user).delete()
+            Shop.objects.filter(user=user).delete()
+            user.delete()
+            Category.objects.filter(id__in=[category['id'] for category in header['categories']]).delete()
+
+    @staticmethod
+    def best(function, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from backend.importer import numeric_value
+from backend.models import ProductParameter
+
+
+class Command(BaseCommand):
+    help = 'Заполняет числовые значения параметров товаров, загруженных до появления поля numeric_value'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        last_id, updated = 0, 0
+        while True:
+            batch = list(ProductParameter.objects.filter(id__gt=last_id, numeric_value__isnull=True)
+                         .order_by('id').only('id', 'value')[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            changed = []
+            for parameter in batch:
+                parameter.numeric_value = numeric_value(parameter.value)
+                if parameter.numeric_value is not None:
+                    changed.append(parameter)
+            ProductParameter.objects.bulk_update(changed, ['numeric_value'])
+            updated += len(changed)
+        self.stdout.write(f'{updated} parameter values updated')
@@ -0,0 +1,27 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.feedgen import FEED_WRITERS, parse_size, write_feed
+
+
+class Command(BaseCommand):
+    help = 'Генерирует синтетический прайс в схеме data/shop1.yaml (например: generate_feed 100k -o feed.yaml)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('size', help='количество товаров: 1000, 10k, 1M')
+        parser.add_argument('--parameters', type=int, default=4, help='количество параметров у товара')
+        parser.add_argument('--format', dest='feed_format', choices=list(FEED_WRITERS), default='yaml')
+        parser.add_argument('-o', '--output', default='-', help='файл для записи, по умолчанию stdout')
+
+    def handle(self, *args, **options):
+        try:
+            goods = parse_size(options['size'])
+        except ValueError as error:
+            raise CommandError(error)
+        if options['output'] == '-':
+            write_feed(sys.stdout, options['feed_format'], goods, options['parameters'])
+            return
+        with open(options['output'], 'w', encoding='utf-8', newline='') as fp:
+            write_feed(fp, options['feed_format'], goods, options['parameters'])
+        self.stderr.write(f'{goods} goods written to {options["output"]}')
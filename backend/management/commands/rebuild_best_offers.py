@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from backend.models import BestOffer, Product
+from backend.offers import rebuild_offers
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает лучшие предложения по всем моделям товаров (например, после загрузки дампа базы)'
+
+    def handle(self, *args, **options):
+        models = set(Product.objects.exclude(model='').values_list('model', flat=True).distinct())
+        # модели, которых больше нет в каталоге, тоже очищаются
+        models.update(BestOffer.objects.values_list('model', flat=True).distinct())
+        rebuild_offers(models)
+        self.stdout.write(f'{len(models)} models rebuilt')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from backend.models import Product
+from backend.search import INDEX_BATCH_SIZE, create_search_index, index_products
+
+
+class Command(BaseCommand):
+    help = 'Заполняет полнотекстовый индекс товаров заново (например, после загрузки дампа базы)'
+
+    def handle(self, *args, **options):
+        create_search_index()
+        product_ids = Product.objects.order_by('id').values_list('id', flat=True)
+        batch, total = [], 0
+        for product_id in product_ids.iterator(chunk_size=INDEX_BATCH_SIZE):
+            batch.append(product_id)
+            if len(batch) == INDEX_BATCH_SIZE:
+                index_products(batch)
+                total += len(batch)
+                batch = []
+        index_products(batch)
+        total += len(batch)
+        self.stdout.write(f'{total} products indexed')
@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django_rest_passwordreset.tokens import get_token_generator
 from django.contrib.auth.base_user import BaseUserManager
@@ -15,6 +16,24 @@ STATE_CHOICES = (
     ('canceled', 'Отменен'),
 )
 
+IMPORT_STAGE_CHOICES = (
+    ('queued', 'В очереди'),
+    ('fetching', 'Загрузка прайса'),
+    ('importing', 'Запись в базу'),
+    ('unchanged', 'Прайс не изменился'),
+    ('done', 'Завершен'),
+    ('failed', 'Ошибка'),
+)
+
+ACTIVE_IMPORT_STAGES = ('queued', 'fetching', 'importing')
+
+FEED_FORMAT_CHOICES = (
+    ('yaml', 'YAML'),
+    ('json', 'JSON'),
+    ('jsonl', 'JSON Lines'),
+    ('csv', 'CSV'),
+)
+
 USER_TYPE_CHOICES = (
     ('shop', 'Магазин'),
     ('buyer', 'Покупатель'),
@@ -114,6 +133,7 @@ class Shop(models.Model):
             'Unselect this instead of deleting accounts.'
         ),
     )
+    updated_at = models.DateTimeField(verbose_name='Время изменения', auto_now=True)
 
     class Meta:
         verbose_name = 'Магазин'
@@ -145,33 +165,81 @@ class Product(models.Model):
     quantity = models.PositiveIntegerField(verbose_name='Количество')
     price = models.PositiveIntegerField(verbose_name='Цена')
     price_rrc = models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена')
+    external_id = models.CharField(max_length=64, verbose_name='Идентификатор в прайсе поставщика', blank=True)
+    content_hash = models.CharField(max_length=40, verbose_name='Хеш товара из прайса', blank=True)
+    updated_at = models.DateTimeField(verbose_name='Время изменения', auto_now=True)
 
     class Meta:
         verbose_name = 'Информация о продукте'
         verbose_name_plural = 'Информационный список о продуктах'
         constraints = [
             models.UniqueConstraint(fields=['name', 'shop', 'price'], name='unique_product_info'),
+            models.UniqueConstraint(fields=['shop', 'external_id'], condition=~models.Q(external_id=''),
+                                    name='unique_product_external_id'),
         ]
 
     def __str__(self):
         return f'name: {self.name}, shop: {self.shop}'
 
 
+class Parameter(models.Model):
+    name = models.CharField(max_length=40, verbose_name='Название', unique=True)
+
+    class Meta:
+        verbose_name = 'Имя параметра'
+        verbose_name_plural = "Список имен параметров"
+        ordering = ('-name',)
+
+    def __str__(self):
+        return self.name
+
+
 class ProductParameter(models.Model):
     product = models.ForeignKey(Product, verbose_name='Информация о продукте',
                                 related_name='product_parameters', blank=True,
                                 on_delete=models.CASCADE)
-    name = models.CharField(max_length=40, verbose_name='Название')
+    parameter = models.ForeignKey(Parameter, verbose_name='Параметр', related_name='product_parameters',
+                                  on_delete=models.CASCADE)
     value = models.CharField(verbose_name='Значение', max_length=100)
+    numeric_value = models.FloatField(verbose_name='Числовое значение', null=True, blank=True,
+                                      help_text='Заполняется при импорте, если значение - число')
 
     class Meta:
         verbose_name = 'Параметр'
         verbose_name_plural = "Список параметров"
         constraints = [
-            models.UniqueConstraint(fields=['product', 'name'], name='unique_product_parameter'),
+            models.UniqueConstraint(fields=['product', 'parameter'], name='unique_product_parameter'),
+        ]
+        indexes = [
+            # диапазонные фильтры products/?range=Параметр:от:до
+            models.Index(fields=['parameter', 'numeric_value'], name='product_parameter_numeric_idx'),
         ]
 
 
+class BestOffer(models.Model):
+    """
+    Лучшие предложения по модели товара: BEST_OFFERS_TOP_K самых дешевых товаров в наличии,
+    в том числе нескольких товаров одного магазина. Строки пересчитываются при изменении цен
+    и остатков (backend/offers.py)
+    """
+    model = models.CharField(max_length=80, verbose_name='Модель')
+    rank = models.PositiveSmallIntegerField(verbose_name='Место по цене')
+    product = models.ForeignKey(Product, verbose_name='Информация о продукте', related_name='best_offers',
+                                on_delete=models.CASCADE)
+    price = models.PositiveIntegerField(verbose_name='Цена')
+
+    class Meta:
+        verbose_name = 'Лучшее предложение'
+        verbose_name_plural = 'Лучшие предложения по моделям'
+        ordering = ('model', 'rank')
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'rank'], name='unique_best_offer_rank'),
+        ]
+
+    def __str__(self):
+        return f'{self.model} #{self.rank}: {self.price}'
+
+
 class Basket(models.Model):
     product = models.ForeignKey(Product, verbose_name='Выбор продуктов для заказа', related_name='baskets',
                                 on_delete=models.CASCADE)
@@ -228,16 +296,64 @@ class Order(models.Model):
     contact = models.ForeignKey(Contact, verbose_name='Контакт', on_delete=models.CASCADE)
     sum_price_product = models.PositiveIntegerField(verbose_name='Суммарная стоимость позиции')
     shop_email = models.EmailField(_('email адрес магазина'), default='sash31.f@mail.ru')
+    updated_at = models.DateTimeField(verbose_name='Время изменения', auto_now=True)
 
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Список заказов'
         ordering = ('-dt',)
+        indexes = [
+            # список заказов покупателя по курсору (-dt, id)
+            models.Index(fields=['user', '-dt', 'id'], name='order_user_dt_idx'),
+        ]
 
     def __str__(self):
         return str(self.dt)
 
 
+class ImportRun(models.Model):
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='import_runs', on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='import_runs', null=True, blank=True,
+                             on_delete=models.SET_NULL)
+    url = models.URLField(verbose_name='Ссылка на прайс')
+    feed_format = models.CharField(verbose_name='Формат прайса', choices=FEED_FORMAT_CHOICES, max_length=5,
+                                   blank=True, help_text='Пустое значение - определить автоматически')
+    stage = models.CharField(verbose_name='Этап', choices=IMPORT_STAGE_CHOICES, default='queued', max_length=15)
+    rows_processed = models.PositiveIntegerField(verbose_name='Обработано товаров', default=0)
+    rows_per_sec = models.FloatField(verbose_name='Товаров в секунду', default=0)
+    content_hash = models.CharField(verbose_name='Хеш скачанного прайса', max_length=64, blank=True)
+    stats = models.JSONField(verbose_name='Статистика импорта', default=dict, blank=True)
+    errors = models.TextField(verbose_name='Ошибки', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    import_started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Импорт прайса'
+        verbose_name_plural = 'Список импортов прайсов'
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return f'{self.url} {self.stage}'
+
+    def set_stage(self, stage, **fields):
+        self.stage = stage
+        for field, value in fields.items():
+            setattr(self, field, value)
+        self.save(update_fields=['stage', *fields])
+
+    def report_progress(self, importer):
+        """ сохраняет прогресс импорта после очередного пакета товаров """
+        self.shop_id = importer.shop.id
+        self.rows_processed = importer.rows_processed
+        # скорость считаем от начала импорта: скачивание и ожидание в очереди в нее не входят
+        elapsed = (timezone.now() - self.import_started_at).total_seconds()
+        self.rows_per_sec = round(self.rows_processed / elapsed, 1) if elapsed else 0
+        self.stats = importer.stats
+        self.save(update_fields=['shop', 'rows_processed', 'rows_per_sec', 'stats'])
+
+
 class ConfirmEmailToken(models.Model):
     class Meta:
         verbose_name = 'Токен подтвеждения Email'
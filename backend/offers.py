@@ -0,0 +1,99 @@
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+
+from backend.cache import bump_versions
+from backend.models import BestOffer, Product
+
+# изменения этих полей меняют лучшие предложения
+OFFER_FIELDS = {'model', 'price', 'quantity'}
+
+OFFER_BATCH_SIZE = 500
+
+# модели, пересчет которых отложен до конца блока deferred_offers() в этом потоке
+_deferred = threading.local()
+
+
+def affected_models(product_ids):
+    """
+    Модели товаров, включая прежние модели, в лучших предложениях которых товары уже стоят
+    """
+    product_ids = list(product_ids)
+    models = set(Product.objects.filter(id__in=product_ids).values_list('model', flat=True))
+    models.update(BestOffer.objects.filter(product_id__in=product_ids).values_list('model', flat=True))
+    return models
+
+
+@transaction.atomic
+def rebuild_offers(models):
+    """
+    Пересчитывает лучшие предложения моделей: одним запросом на пакет моделей
+    выбираются товары в наличии по возрастанию цены, остаются первые BEST_OFFERS_TOP_K
+    """
+    models = sorted(models)
+    for start in range(0, len(models), OFFER_BATCH_SIZE):
+        batch = models[start:start + OFFER_BATCH_SIZE]
+        # блокировка товаров моделей в одном порядке: параллельный пересчет той же модели
+        # ждет, а не падает на unique (model, rank) между удалением и вставкой строк
+        list(Product.objects.select_for_update().filter(model__in=batch).order_by('id').values_list('id', flat=True))
+        offers = defaultdict(list)
+        for product_id, model, price in Product.objects.filter(model__in=batch, quantity__gt=0).order_by(
+                'model', 'price', 'id').values_list('id', 'model', 'price'):
+            if len(offers[model]) < settings.BEST_OFFERS_TOP_K:
+                offers[model].append(BestOffer(model=model, rank=len(offers[model]), product_id=product_id,
+                                               price=price))
+        BestOffer.objects.filter(model__in=batch).delete()
+        BestOffer.objects.bulk_create([offer for items in offers.values() for offer in items])
+    # пересчет идет после фиксации импорта, когда версия products уже сброшена: ответ products/offers/,
+    # закешированный в промежутке, сбрасывается своей версией
+    bump_versions(['offers'])
+
+
+def schedule_rebuild(models):
+    """
+    Пересчет после фиксации транзакции; внутри deferred_offers() модели копятся до конца блока
+    """
+    models = set(models) - {'', None}
+    if not models:
+        return
+    pending = getattr(_deferred, 'models', None)
+    if pending is not None:
+        pending.update(models)
+    else:
+        transaction.on_commit(lambda: rebuild_offers(models))
+
+
+@contextmanager
+def deferred_offers():
+    """
+    Копит затронутые модели и пересчитывает их один раз в конце блока, а не на каждый пакет
+    импорта или на каждый сигнал одной правки
+    """
+    if getattr(_deferred, 'models', None) is not None:
+        yield
+        return
+    _deferred.models = set()
+    try:
+        yield
+    finally:
+        models, _deferred.models = _deferred.models, None
+        schedule_rebuild(models)
+
+
+def update_best_offers(sender, product_ids, fields=None, **kwargs):
+    """
+    Обработчик catalog_updated: пересчитывает модели, у товаров которых изменились цена, остаток или модель
+    """
+    if fields is None or OFFER_FIELDS & set(fields):
+        schedule_rebuild(affected_models(product_ids))
+
+
+def update_saved_offers(sender, instance, **kwargs):
+    """
+    Обработчик post_save/post_delete товара для правок через API и админку
+    """
+    schedule_rebuild({instance.model} | set(BestOffer.objects.filter(product_id=instance.pk)
+                                            .values_list('model', flat=True)))
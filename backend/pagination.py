@@ -0,0 +1,60 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+def ordering_columns(view):
+    """
+    Поля порядка курсора представления: строки из .values() должны их содержать,
+    иначе не построить ссылку на следующую страницу
+    """
+    ordering = getattr(view, 'cursor_ordering', 'id')
+    if isinstance(ordering, str):
+        ordering = (ordering,)
+    return [field.lstrip('-') for field in ordering]
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Пагинация по непрозрачному курсору: следующая страница выбирается условием
+    WHERE по последней записи предыдущей, без COUNT(*) и OFFSET, поэтому время
+    ответа не растет с номером страницы. Порядок задается атрибутом
+    cursor_ordering представления
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.ordering = getattr(view, 'cursor_ordering', 'id')
+        return super().paginate_queryset(queryset, request, view)
+
+
+class OptionalKeysetPagination(PageNumberPagination):
+    """
+    По умолчанию обычная постраничная навигация ?page=N, а с параметром
+    ?pagination=cursor (или при переходе по ссылке с ?cursor=...) - KeysetPagination
+    """
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+
+    def __init__(self):
+        self.keyset = None
+
+    def is_keyset_request(self, request):
+        return self.cursor_query_param in request.query_params \
+            or request.query_params.get(self.mode_query_param) == 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.is_keyset_request(request):
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.keyset = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.keyset is not None:
+            return self.keyset.to_html()
+        return super().to_html()
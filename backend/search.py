@@ -0,0 +1,127 @@
+import re
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Q
+
+from backend.models import Product, ProductParameter
+
+SEARCH_TABLE = 'backend_product_search'
+
+# изменения этих полей требуют переиндексации товара
+TEXT_FIELDS = {'name', 'model', 'parameters'}
+
+INDEX_BATCH_SIZE = 500
+
+POSTGRES_SCHEMA = (
+    f'CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ('
+    f'product_id integer PRIMARY KEY REFERENCES backend_product (id) ON DELETE CASCADE, '
+    f'document tsvector NOT NULL)',
+    f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document ON {SEARCH_TABLE} USING gin (document)',
+)
+
+POSTGRES_UPSERT = (
+    f'INSERT INTO {SEARCH_TABLE} (product_id, document) VALUES (%s, '
+    f"setweight(to_tsvector(%s::regconfig, %s), 'A') || "
+    f"setweight(to_tsvector(%s::regconfig, %s), 'B') || "
+    f"setweight(to_tsvector(%s::regconfig, %s), 'C')) "
+    f'ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document'
+)
+
+POSTGRES_SEARCH = (
+    f'SELECT product_id FROM {SEARCH_TABLE}, to_tsquery(%s::regconfig, %s) query '
+    f'WHERE document @@ query ORDER BY ts_rank(document, query) DESC, product_id LIMIT %s'
+)
+
+# строки FTS5 связаны с товаром через rowid = Product.id
+SQLITE_SCHEMA = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(name, model, parameters)',
+)
+
+# bm25 тем меньше, чем лучше совпадение; веса колонок: название, модель, параметры
+SQLITE_SEARCH = (
+    f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s '
+    f'ORDER BY bm25({SEARCH_TABLE}, 10.0, 5.0, 1.0), rowid LIMIT %s'
+)
+
+
+def _connection(using=None):
+    return connections[using or router.db_for_write(Product)]
+
+
+def create_search_index(using='default', **kwargs):
+    """
+    Создает таблицу полнотекстового индекса товаров (обработчик post_migrate)
+    """
+    connection = connections[using]
+    schema = {'postgresql': POSTGRES_SCHEMA, 'sqlite': SQLITE_SCHEMA}.get(connection.vendor, ())
+    with connection.cursor() as cursor:
+        for statement in schema:
+            cursor.execute(statement)
+
+
+def index_products(product_ids, using=None):
+    """
+    Пересчитывает поисковые документы товаров: название, модель и значения параметров
+    """
+    connection = _connection(using)
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        return
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), INDEX_BATCH_SIZE):
+        batch = product_ids[start:start + INDEX_BATCH_SIZE]
+        parameters = defaultdict(list)
+        for product_id, value in ProductParameter.objects.using(connection.alias).filter(
+                product_id__in=batch).values_list('product_id', 'value'):
+            parameters[product_id].append(value)
+        rows = [
+            (product_id, name, model, ' '.join(parameters[product_id]))
+            for product_id, name, model in Product.objects.using(connection.alias).filter(
+                id__in=batch).values_list('id', 'name', 'model')
+        ]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                config = settings.PRODUCT_SEARCH_CONFIG
+                cursor.executemany(POSTGRES_UPSERT, [
+                    (product_id, config, name, config, model, config, values)
+                    for product_id, name, model, values in rows
+                ])
+            else:
+                cursor.executemany(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [(pk,) for pk in batch])
+                cursor.executemany(f'INSERT INTO {SEARCH_TABLE} (rowid, name, model, parameters) '
+                                   f'VALUES (%s, %s, %s, %s)', rows)
+
+
+def update_search_index(sender, product_ids, fields=None, **kwargs):
+    """
+    Обработчик catalog_updated: переиндексирует товары, у которых изменился текст
+    """
+    if fields is None or TEXT_FIELDS & set(fields):
+        index_products(product_ids)
+
+
+def search_product_ids(query, limit=None, using=None):
+    """
+    id товаров, подходящих под запрос, в порядке убывания релевантности.
+    Каждое слово запроса ищется как префикс, все слова должны совпасть
+    """
+    words = re.findall(r'\w+', query.lower())
+    if not words:
+        return []
+    limit = limit or settings.PRODUCT_SEARCH_LIMIT
+    connection = _connection(using)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(POSTGRES_SEARCH, (settings.PRODUCT_SEARCH_CONFIG,
+                                             ' & '.join(f"'{word}':*" for word in words), limit))
+        elif connection.vendor == 'sqlite':
+            cursor.execute(SQLITE_SEARCH, (' '.join(f'"{word}"*' for word in words), limit))
+        else:
+            # без полнотекстового индекса - поиск подстроки без ранжирования
+            condition = Q()
+            for word in words:
+                condition &= Q(name__icontains=word) | Q(model__icontains=word)
+            return list(Product.objects.using(connection.alias).filter(condition)
+                        .order_by('id').values_list('id', flat=True)[:limit])
+        return [row[0] for row in cursor.fetchall()]
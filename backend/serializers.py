@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from backend.models import User, Category, Product, Shop, Order, Contact, Basket, ProductParameter
+from backend.models import User, Category, Product, Shop, Order, Contact, Basket, ProductParameter, ImportRun
 
 
 class ContactSerializer(serializers.ModelSerializer):
@@ -35,16 +35,16 @@ class ShopSerializer(serializers.ModelSerializer):
 
 
 class ProductParameterSerializer(serializers.ModelSerializer):
-    parameter = serializers.StringRelatedField()
+    name = serializers.CharField(source='parameter.name', read_only=True)
 
     class Meta:
         model = ProductParameter
-        fields = ('name', 'value', 'parameter')
+        fields = ('name', 'value')
         read_only_fields = ('id',)
 
 
 class ProductSerializer(serializers.ModelSerializer):
-    parameter = ProductParameterSerializer(read_only=True, many=True)
+    parameter = ProductParameterSerializer(source='product_parameters', read_only=True, many=True)
     shop = serializers.StringRelatedField()
     category = serializers.StringRelatedField()
 
@@ -86,3 +86,11 @@ class OrderItemSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'order': {'write_only': True}
         }
+
+
+class ImportRunSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImportRun
+        fields = ('id', 'url', 'feed_format', 'shop', 'stage', 'rows_processed', 'rows_per_sec', 'stats', 'errors',
+                  'created_at', 'started_at', 'import_started_at', 'finished_at')
+        read_only_fields = fields
@@ -0,0 +1,10 @@
+from django.dispatch import Signal
+
+# Товары каталога изменились (импорт прайса, остатки, ручное добавление, оформление заказа).
+# Аргументы: product_ids - id измененных товаров; fields - имена измененных полей
+# ('parameters' для параметров товара) или None, если товар мог измениться целиком;
+# category_ids (необязательно) - прежние категории товаров, перенесенных в другую категорию
+catalog_updated = Signal()
+
+# Категории созданы или переименованы при импорте прайса. Аргументы: category_ids
+categories_updated = Signal()
@@ -0,0 +1,91 @@
+import codecs
+import csv
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from backend.models import Product
+from backend.signals import catalog_updated
+
+DELTA_FIELDS = ('quantity', 'price', 'price_rrc')
+# верхняя граница PositiveIntegerField на всех поддерживаемых базах
+MAX_DELTA_VALUE = 2147483647
+
+
+class CsvDeltaParser(BaseParser):
+    """
+    Строки external_id,quantity,price,price_rrc из тела запроса text/csv
+    """
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        rows = [row for row in csv.reader(codecs.iterdecode(stream, encoding)) if row]
+        if rows and rows[0][0].strip().lower() in ('id', 'external_id'):
+            rows = rows[1:]
+        return rows
+
+
+def parse_delta(rows):
+    """
+    Приводит строки [external_id, quantity, price, price_rrc] к кортежам; пустое или
+    отсутствующее значение означает, что поле не меняется
+    """
+    items = []
+    for number, row in enumerate(rows, start=1):
+        if isinstance(row, dict):
+            row = [row.get('id', row.get('external_id')), *(row.get(field) for field in DELTA_FIELDS)]
+        if not isinstance(row, (list, tuple)) or not 1 < len(row) <= 4 or row[0] in (None, ''):
+            raise ParseError(f'Row {number}: expected external_id, quantity, price, price_rrc')
+        values = []
+        for value in list(row[1:]) + [None] * (4 - len(row)):
+            if value in (None, ''):
+                values.append(None)
+                continue
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ParseError(f'Row {number}: {value!r} is not a number')
+            if value < 0:
+                raise ParseError(f'Row {number}: {value} is negative')
+            if value > MAX_DELTA_VALUE:
+                raise ParseError(f'Row {number}: {value} is larger than {MAX_DELTA_VALUE}')
+            values.append(value)
+        items.append((str(row[0]).strip(), *values))
+    return items
+
+
+@transaction.atomic
+def apply_stock_delta(shop, items, batch_size=None):
+    """
+    Применяет изменения остатков и цен одним UPDATE ... CASE на пакет строк.
+    Возвращает количество измененных товаров и external_id, не найденные в магазине
+    """
+    batch_size = batch_size or settings.PARTNER_DELTA_BATCH_SIZE
+    updated, missing = 0, []
+    for start in range(0, len(items), batch_size):
+        batch = {item[0]: item[1:] for item in items[start:start + batch_size]}
+        found = dict(Product.objects.filter(shop_id=shop.id, external_id__in=list(batch))
+                     .values_list('external_id', 'id'))
+        missing.extend(external_id for external_id in batch if external_id not in found)
+        # строки без единого значения ничего не меняют и не считаются обновленными
+        changed = [external_id for external_id, values in batch.items()
+                   if external_id in found and any(value is not None for value in values)]
+        products = Product.objects.filter(id__in=[found[external_id] for external_id in changed])
+
+        changes = {}
+        for index, field in enumerate(DELTA_FIELDS):
+            whens = [When(external_id=external_id, then=Value(values[index]))
+                     for external_id, values in batch.items() if external_id in found and values[index] is not None]
+            if whens:
+                changes[field] = Case(*whens, default=F(field), output_field=PositiveIntegerField())
+        if changes:
+            # сбрасываем хеш, чтобы следующий полный импорт прайса снова записал эти товары
+            updated += products.update(content_hash='', updated_at=timezone.now(), **changes)
+            catalog_updated.send(sender=Product, product_ids=[found[external_id] for external_id in changed],
+                                 fields=tuple(changes))
+    return updated, missing
@@ -0,0 +1,247 @@
+import json
+import re
+import threading
+import zlib
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from backend.models import Category, Product
+
+# изменения этих полей меняют подсказки
+SUGGEST_FIELDS = {'name', 'model'}
+
+LOG_SEQUENCE_KEY = 'suggest:sequence'
+LOG_ENTRY_KEY = 'suggest:log:{}'
+SNAPSHOT_KEY = 'suggest:snapshot'
+SNAPSHOT_SEQUENCE_KEY = 'suggest:snapshot:sequence'
+
+WORD = re.compile(r'\w+')
+
+
+def normalize(text):
+    return ' '.join(WORD.findall(text.lower()))
+
+
+class SuggestIndex:
+    """
+    Префиксный индекс подсказок в памяти процесса: отсортированный список ключей
+    (нормализованный текст, начиная с каждого слова) и поиск диапазона через bisect.
+    Подсказки - названия товаров, модели и названия категорий, одинаковые тексты
+    разных товаров хранятся один раз со счетчиком.
+
+    Индекс загружается из сжатого снимка в кеше Django (или строится из базы, и снимок
+    сохраняется), затем, как и FacetIndex, дочитывает журнал изменений каталога
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        self.built = False
+        self.sequence = 0
+        self.keys = []
+        self.counts = Counter()
+        self.products = {}
+        self.categories = {}
+
+    def rebuild(self):
+        with self.lock:
+            self.reset()
+            snapshot = cache.get(SNAPSHOT_KEY)
+            if snapshot is not None:
+                self.sequence, data = snapshot[0], json.loads(zlib.decompress(snapshot[1]))
+            else:
+                self.sequence = cache.get(LOG_SEQUENCE_KEY, 0)
+                data = {'products': list(Product.objects.values_list('id', 'name', 'model').iterator()),
+                        'categories': list(Category.objects.values_list('id', 'name'))}
+            changes = {}
+            for product_id, name, model in data['products']:
+                self._set_product(product_id, (name, model), changes)
+            for category_id, name in data['categories']:
+                self._set_category(category_id, name, changes)
+            self._apply(changes)
+            self.built = True
+            if snapshot is None:
+                self.save_snapshot()
+
+    def save_snapshot(self):
+        """
+        Сохраняет текущее состояние индекса в кеш, чтобы новые процессы не строили его из базы
+        """
+        with self.lock:
+            data = {'products': [(product_id, name, model) for product_id, (name, model) in self.products.items()],
+                    'categories': list(self.categories.items())}
+            cache.set(SNAPSHOT_KEY, (self.sequence, zlib.compress(json.dumps(data).encode())),
+                      timeout=settings.SUGGEST_SNAPSHOT_TIMEOUT)
+            cache.set(SNAPSHOT_SEQUENCE_KEY, self.sequence, timeout=settings.SUGGEST_SNAPSHOT_TIMEOUT)
+
+    def refresh(self, product_ids=(), category_ids=()):
+        """
+        Перечитывает из базы указанные товары и категории, удаленные исключаются из индекса.
+        Товары с прежними названием и моделью ключей не меняют
+        """
+        with self.lock:
+            changes = {}
+            products = {product_id: (name, model) for product_id, name, model in
+                        Product.objects.filter(id__in=list(product_ids)).values_list('id', 'name', 'model')}
+            for product_id in product_ids:
+                if self.products.get(product_id) != products.get(product_id):
+                    self._set_product(product_id, products.get(product_id), changes)
+            categories = dict(Category.objects.filter(id__in=list(category_ids)).values_list('id', 'name'))
+            for category_id in category_ids:
+                if self.categories.get(category_id) != categories.get(category_id):
+                    self._set_category(category_id, categories.get(category_id), changes)
+            self._apply(changes)
+
+    def ensure_current(self):
+        """
+        Применяет изменения из журнала, записанные после последнего обновления индекса
+        """
+        with self.lock:
+            if not self.built:
+                self.rebuild()
+            sequence = cache.get(LOG_SEQUENCE_KEY, 0)
+            if sequence == self.sequence:
+                return
+            if not 0 < sequence - self.sequence <= settings.SUGGEST_LOG_MAX_ENTRIES:
+                # снимок устарел или журнал начат заново - строим индекс и снимок из базы
+                cache.delete(SNAPSHOT_KEY)
+                return self.rebuild()
+            keys = [LOG_ENTRY_KEY.format(number) for number in range(self.sequence + 1, sequence + 1)]
+            entries = cache.get_many(keys)
+            if len(entries) != len(keys):
+                cache.delete(SNAPSHOT_KEY)
+                return self.rebuild()
+            self.refresh({product_id for entry in entries.values() for product_id in entry['products']},
+                         {category_id for entry in entries.values() for category_id in entry['categories']})
+            self.sequence = sequence
+            # снимок обновляется, пока журнал после него не стал длиннее SUGGEST_LOG_MAX_ENTRIES
+            if sequence - cache.get(SNAPSHOT_SEQUENCE_KEY, 0) >= settings.SUGGEST_SNAPSHOT_INTERVAL:
+                self.save_snapshot()
+
+    def suggest(self, query, limit=None):
+        """
+        Подсказки, у которых какое-либо слово начинается с query: сначала совпадения
+        с начала текста, затем более короткие
+        """
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        limit = limit or settings.SUGGEST_LIMIT
+        with self.lock:
+            self.ensure_current()
+            found = {}
+            index = bisect_left(self.keys, (prefix,))
+            # просматриваем ограниченное число ключей, чтобы короткий префикс не обходил весь индекс
+            for key, kind, text, position in self.keys[index:index + limit * settings.SUGGEST_SCAN_FACTOR]:
+                if not key.startswith(prefix):
+                    break
+                found[kind, text] = min(position, found.get((kind, text), position))
+        ranked = sorted(found.items(), key=lambda item: (item[1] > 0, len(item[0][1]), item[0][1]))
+        return [{'text': text, 'type': kind} for (kind, text), _ in ranked[:limit]]
+
+    def _set_product(self, product_id, values, changes):
+        old = self.products.pop(product_id, None)
+        if old is not None:
+            self._remove('product', old[0], changes)
+            self._remove('model', old[1], changes)
+        if values is not None:
+            self.products[product_id] = values
+            self._add('product', values[0], changes)
+            self._add('model', values[1], changes)
+
+    def _set_category(self, category_id, name, changes):
+        old = self.categories.pop(category_id, None)
+        if old is not None:
+            self._remove('category', old, changes)
+        if name is not None:
+            self.categories[category_id] = name
+            self._add('category', name, changes)
+
+    def _add(self, kind, text, changes):
+        # changes - ключ -> должен ли он остаться в индексе; применяются разом в _apply
+        if not text:
+            return
+        self.counts[kind, text] += 1
+        if self.counts[kind, text] == 1:
+            changes.update(dict.fromkeys(_keys(kind, text), True))
+
+    def _remove(self, kind, text, changes):
+        if not text:
+            return
+        self.counts[kind, text] -= 1
+        if self.counts[kind, text] <= 0:
+            del self.counts[kind, text]
+            changes.update(dict.fromkeys(_keys(kind, text), False))
+
+    def _apply(self, changes):
+        """
+        Вносит изменения в отсортированный список ключей: несколько ключей вставляются
+        и удаляются по одному через bisect, большой пакет - одним проходом по списку и
+        одной сортировкой, иначе вставка на каждый ключ делала бы обновление квадратичным
+        """
+        if len(changes) <= settings.SUGGEST_INSORT_LIMIT:
+            for key, present in changes.items():
+                index = bisect_left(self.keys, key)
+                found = index < len(self.keys) and self.keys[index] == key
+                if present and not found:
+                    self.keys.insert(index, key)
+                elif not present and found:
+                    del self.keys[index]
+            return
+        keys = [key for key in self.keys if key not in changes]
+        keys.extend(key for key, present in changes.items() if present)
+        keys.sort()
+        self.keys = keys
+
+
+def _keys(kind, text):
+    # ключ на каждое слово текста: "iph" находит и "Смартфон Apple iPhone XR"
+    words = normalize(text).split()
+    return [(' '.join(words[position:]), kind, text, position) for position in range(len(words))]
+
+
+suggest_index = SuggestIndex()
+
+
+def log_suggest_change(product_ids=(), category_ids=()):
+    """
+    Добавляет id измененных товаров и категорий в журнал индекса подсказок
+    """
+    cache.add(LOG_SEQUENCE_KEY, 0, timeout=None)
+    sequence = cache.incr(LOG_SEQUENCE_KEY)
+    cache.set(LOG_ENTRY_KEY.format(sequence), {'products': list(product_ids), 'categories': list(category_ids)},
+              timeout=settings.SUGGEST_LOG_TIMEOUT)
+
+
+def update_suggest_index(sender, product_ids, fields=None, **kwargs):
+    """
+    Обработчик catalog_updated: изменения попадают в журнал после фиксации транзакции
+    """
+    if fields is None or SUGGEST_FIELDS & set(fields):
+        product_ids = list(product_ids)
+        transaction.on_commit(lambda: log_suggest_change(product_ids=product_ids))
+
+
+def update_suggest_categories(sender, category_ids, **kwargs):
+    """
+    Обработчик categories_updated
+    """
+    category_ids = list(category_ids)
+    transaction.on_commit(lambda: log_suggest_change(category_ids=category_ids))
+
+
+def update_saved_suggestions(sender, instance, **kwargs):
+    """
+    Обработчик post_save/post_delete товаров и категорий для правок через API и админку
+    """
+    ids = [instance.pk]
+    if sender is Category:
+        transaction.on_commit(lambda: log_suggest_change(category_ids=ids))
+    else:
+        transaction.on_commit(lambda: log_suggest_change(product_ids=ids))
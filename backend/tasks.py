@@ -1,11 +1,25 @@
 # feedback/tasks.py
 
+import uuid
+import zlib
+from contextlib import contextmanager
+from datetime import timedelta
 from time import sleep
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
 from django.core.mail import send_mail
+from django.utils import timezone
 from celery import shared_task
-from yaml import load as load_yaml, Loader
-from requests import get
-import yaml
+from celery.signals import worker_init
+
+from backend.fetch import FeedCache, FeedFetchError, FetchedFeed, fetch_many
+from backend.importer import import_feed
+from backend.models import ACTIVE_IMPORT_STAGES, ImportRun, Shop
+
+IMPORT_SLOT_KEY = 'feed-import:slot:{}'
 
 
 @shared_task()
@@ -22,11 +36,119 @@ def send_email_task(email_address, message):
 
 
 @shared_task()
-def shop_data_task(url):
+def fetch_feeds_task(import_run_ids):
+    """Downloads price lists of several import runs concurrently and queues their import"""
+    import_runs = list(ImportRun.objects.filter(pk__in=import_run_ids))
+    for import_run in import_runs:
+        import_run.set_stage('fetching', started_at=timezone.now())
+
+    feeds = fetch_many(import_run.url for import_run in import_runs)
+    for import_run in import_runs:
+        feed = feeds[import_run.url]
+        if isinstance(feed, FeedFetchError):
+            import_run.set_stage('failed', errors=str(feed), finished_at=timezone.now())
+        elif not feed.changed:
+            import_run.set_stage('unchanged', finished_at=timezone.now())
+        else:
+            import_run.set_stage('queued', content_hash=feed.content_hash)
+            import_feed_task.delay(import_run.id, feed.content_hash)
+
+
+def cache_is_shared():
+    """ кеш Django виден всем процессам: LocMem и Dummy живут в памяти одного процесса """
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+@worker_init.connect
+def require_shared_cache(sender, **kwargs):
+    """
+    Места импортов (import_slot) и поиск прерванных импортов хранятся в кеше Django: при кеше
+    в памяти процесса у каждого процесса воркера свои места, а живые импорты других процессов
+    выглядят прерванными. Воркер из нескольких процессов без общего кеша не запускается
+    """
+    if sender.concurrency > 1 and 'prefork' in str(sender.pool_cls) and not cache_is_shared():
+        raise ImproperlyConfigured('Price list imports need a shared Django cache with several worker processes: '
+                                   'set CACHE_REDIS_URL or start the worker with --pool threads or -c 1')
+
+
+@contextmanager
+def import_slot(import_run_id):
+    """
+    Занимает одно из FEED_SYNC_MAX_IMPORTS мест для импорта в общем кеше, None - свободных мест нет.
+    Место освобождается само через FEED_IMPORT_TIMEOUT, если процесс импорта упал
+    """
+    token = f'{import_run_id}:{uuid.uuid4().hex}'
+    for slot in range(settings.FEED_SYNC_MAX_IMPORTS):
+        key = IMPORT_SLOT_KEY.format(slot)
+        if cache.add(key, token, timeout=settings.FEED_IMPORT_TIMEOUT):
+            break
+    else:
+        yield None
+        return
     try:
-        stream = get(url).content
-        data = load_yaml(stream, Loader=Loader)
-    except:
-        with open('./data/shop1.yaml') as data_shop:
-            data = yaml.load(data_shop, Loader=yaml.FullLoader)
-    return data
+        yield key
+    finally:
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+@shared_task(bind=True, max_retries=None)
+def import_feed_task(self, import_run_id, content_hash):
+    """Imports a downloaded price list from the feed cache, tracking progress in ImportRun"""
+    with import_slot(import_run_id) as slot:
+        if slot is None:
+            # не даем импортам занять всю базу, чтобы чтение каталога не простаивало
+            raise self.retry(countdown=settings.FEED_SYNC_RETRY_DELAY)
+        import_run = ImportRun.objects.get(pk=import_run_id)
+        feed = FetchedFeed(FeedCache(import_run.url), content_hash)
+
+        def progress(importer):
+            # место продлевается, пока импорт подает признаки жизни
+            cache.touch(slot, settings.FEED_IMPORT_TIMEOUT)
+            import_run.report_progress(importer)
+
+        import_run.set_stage('importing', import_started_at=timezone.now())
+        try:
+            with open(feed.path, 'rb') as stream:
+                stats = import_feed(stream, import_run.user_id, progress=progress,
+                                    feed_format=import_run.feed_format, url=import_run.url)
+            feed.mark_imported()
+        except Exception as error:
+            import_run.set_stage('failed', errors=str(error), finished_at=timezone.now())
+            raise
+        finally:
+            # тела прайсов, которые ждут другие импорты этого url, не удаляем
+            feed.cache.prune(ImportRun.objects.filter(url=import_run.url, stage__in=ACTIVE_IMPORT_STAGES)
+                             .exclude(pk=import_run.pk).values_list('content_hash', flat=True))
+    import_run.set_stage('done', stats=stats, finished_at=timezone.now())
+    return stats
+
+
+@shared_task()
+def schedule_feed_sync_task():
+    """Queues price list sync for every active shop with a url, staggered over FEED_SYNC_INTERVAL"""
+    interval = settings.FEED_SYNC_INTERVAL
+    # импорт, упавший вместе с процессом, навсегда остался бы на этапе importing: его место в кеше истекло
+    held = cache.get_many([IMPORT_SLOT_KEY.format(slot) for slot in range(settings.FEED_SYNC_MAX_IMPORTS)])
+    ImportRun.objects.filter(
+        stage='importing', import_started_at__lt=timezone.now() - timedelta(seconds=settings.FEED_IMPORT_TIMEOUT),
+    ).exclude(
+        pk__in=[int(token.split(':')[0]) for token in held.values()],
+    ).update(stage='failed', errors='Import was interrupted', finished_at=timezone.now())
+    # незавершенный импорт магазина поглощает повторную синхронизацию
+    pending = set(
+        ImportRun.objects.filter(stage__in=ACTIVE_IMPORT_STAGES,
+                                 created_at__gte=timezone.now() - timedelta(seconds=2 * interval))
+        .values_list('user_id', 'url')
+    )
+    shops = Shop.objects.filter(state=True, is_active=True, user__isnull=False, url__isnull=False).exclude(url='')
+    scheduled = 0
+    for shop in shops:
+        if (shop.user_id, shop.url) in pending:
+            continue
+        import_run = ImportRun.objects.create(user_id=shop.user_id, shop=shop, url=shop.url)
+        # у каждого магазина постоянное смещение внутри интервала, синхронизации не приходят разом
+        countdown = zlib.crc32(str(shop.id).encode()) % interval
+        fetch_feeds_task.apply_async(args=[[import_run.id]], countdown=countdown)
+        scheduled += 1
+    return scheduled
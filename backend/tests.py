@@ -4,6 +4,18 @@ import django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'orders.settings')
 django.setup()
 from rest_framework.test import APITestCase
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+import yaml
 from rest_framework.authtoken.models import Token
 
 
@@ -275,12 +287,1331 @@ class AccountTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
+def load_price_list():
+    """
+    Parsed data/shop1.yaml.
+    """
+    with open(os.path.join(settings.BASE_DIR, 'data', 'shop1.yaml')) as data_shop:
+        return yaml.safe_load(data_shop)
 
 
+def captured_sql(context, table='backend_'):
+    """
+    SQL from CaptureQueriesContext mentioning the table prefix (an empty prefix keeps every query),
+    without the silk profiler queries, their EXPLAIN and transaction savepoints.
+    """
+    return [query['sql'] for query in context.captured_queries if table in query['sql']
+            and not any(marker in query['sql'] for marker in ('silk_', 'EXPLAIN', 'SAVEPOINT'))]
 
 
+class PriceListFixture:
+    """
+    Shop with the price list of data/shop1.yaml imported
+    """
 
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_shop()
+        cls.import_price_list()
 
+    @classmethod
+    def create_shop(cls):
+        from backend.models import Shop, User
+        cls.user = User.objects.create_user(email='shop@mail.ru', password='Daiojkghrth86g', type='shop')
+        cls.shop = Shop.objects.create(name='Связной', user=cls.user)
+        cls.data = load_price_list()
 
+    @classmethod
+    def import_price_list(cls):
+        from backend.importer import PriceListImporter, parameter_cache
+        parameter_cache.clear()
+        with cls.captureOnCommitCallbacks(execute=True):
+            PriceListImporter(cls.shop).run(cls.data['categories'], cls.data['goods'])
 
 
+class CatalogFixture(PriceListFixture):
+    """
+    Price list of data/shop1.yaml, a buyer with every product in the basket and ordered
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        from backend.models import Basket, Contact, Order, Product, User
+        super().setUpTestData()
+        cls.buyer = User.objects.create_user(email='buyer@mail.ru', password='Daiojkghrth86g', type='buyer')
+        contact = Contact.objects.create(user=cls.buyer, type='phone', value='1', city='Москва', street='Тверская',
+                                         phone='+79990000000')
+        for product in Product.objects.all():
+            Basket.objects.create(user=cls.buyer, product=product, shop=cls.shop, quantity=1,
+                                  sum_price_product=product.price)
+            cls.order = Order.objects.create(user=cls.buyer, product=product, shop=cls.shop, quantity=1,
+                                             contact=contact, sum_price_product=product.price)
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+
+class PriceListImporterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        from backend.models import Shop, User
+        user = User.objects.create_user(email='shop@mail.ru', password='Daiojkghrth86g', type='shop')
+        cls.shop = Shop.objects.create(name='Связной', user=user)
+        cls.data = load_price_list()
+
+    def setUp(self):
+        from backend.importer import parameter_cache
+        parameter_cache.clear()
+
+    def run_import(self, chunk_size=2):
+        from backend.importer import PriceListImporter
+        return PriceListImporter(self.shop, chunk_size=chunk_size).run(self.data['categories'], self.data['goods'])
+
+    def test_first_import(self):
+        """
+        All rows of a new price list are inserted.
+        """
+        from backend.models import Parameter
+        stats = self.run_import()
+        self.assertEqual(stats['categories']['inserted'], 3)
+        self.assertEqual(stats['products']['inserted'], 4)
+        self.assertEqual(stats['parameters']['inserted'], 16)
+        self.assertEqual(Parameter.objects.count(), 4)
+
+    def test_repeated_import(self):
+        """
+        Re-import of the same price list changes nothing, a new quantity updates one row.
+        """
+        self.run_import()
+        stats = self.run_import()
+        self.assertEqual(stats['products'], {'inserted': 0, 'updated': 0, 'unchanged': 4, 'withdrawn': 0})
+        self.assertEqual(stats['parameters'], {'inserted': 0, 'updated': 0, 'unchanged': 16, 'deleted': 0})
+
+        self.data['goods'][0]['quantity'] += 1
+        stats = self.run_import()
+        self.assertEqual(stats['products'], {'inserted': 0, 'updated': 1, 'unchanged': 3, 'withdrawn': 0})
+
+    def test_parameter_serializer(self):
+        """
+        Parameter names come from the dictionary table, the output keeps name and value.
+        """
+        from backend.models import ProductParameter
+        from backend.serializers import ProductParameterSerializer
+        self.run_import()
+        parameter = ProductParameter.objects.get(product__external_id='4216292', parameter__name='Цвет')
+        self.assertEqual(ProductParameterSerializer(parameter).data, {'name': 'Цвет', 'value': 'золотистый'})
+
+    def test_dropped_parameters(self):
+        """
+        A parameter removed from a good in the price list is deleted from the product.
+        """
+        from backend.models import ProductParameter
+        self.run_import()
+        good = self.data['goods'][0]
+        name = next(iter(good['parameters']))
+        del good['parameters'][name]
+        stats = self.run_import()
+        self.assertEqual(stats['parameters']['deleted'], 1)
+        self.assertFalse(ProductParameter.objects.filter(product__external_id=str(good['id']),
+                                                         parameter__name=name).exists())
+        self.assertEqual(ProductParameter.objects.filter(product__external_id=str(good['id'])).count(),
+                         len(good['parameters']))
+
+    def test_vanished_goods(self):
+        """
+        Goods missing from a re-sent price list are withdrawn from sale.
+        """
+        from backend.models import Product
+        self.run_import()
+        vanished = self.data['goods'].pop()
+        stats = self.run_import()
+        self.assertEqual(stats['products'], {'inserted': 0, 'updated': 0, 'unchanged': 3, 'withdrawn': 1})
+        product = Product.objects.get(shop=self.shop, external_id=str(vanished['id']))
+        self.assertEqual(product.quantity, 0)
+
+    def test_empty_price_list(self):
+        """
+        A re-sent price list without goods fails instead of withdrawing the whole catalog.
+        """
+        from backend.feeds import FeedError
+        from backend.models import Product
+        self.run_import()
+        self.data['goods'] = None
+        with self.assertRaises(FeedError):
+            self.run_import()
+        self.assertFalse(Product.objects.filter(shop=self.shop, quantity=0).exists())
+
+    def test_numeric_values(self):
+        """
+        Numeric parameter values are stored in numeric_value, other values leave it empty.
+        """
+        from backend.importer import numeric_value
+        from backend.models import ProductParameter
+        self.run_import()
+        values = ProductParameter.objects.filter(parameter__name='Встроенная память (Гб)')
+        self.assertEqual(sorted(values.values_list('numeric_value', flat=True)), [256.0, 256.0, 256.0, 512.0])
+        self.assertFalse(ProductParameter.objects.filter(parameter__name='Цвет', numeric_value__isnull=False))
+        self.assertEqual([numeric_value(value) for value in ('6,5', ' 6.1 ', '-2', '1e3', '4G', True)],
+                         [6.5, 6.1, -2.0, None, None, None])
+
+    def test_invalid_good(self):
+        """
+        A malformed good is rejected before anything of its chunk is written.
+        """
+        from backend.feeds import FeedError
+        from backend.models import Product
+        self.data['goods'][1]['price'] = '110000'
+        with self.assertRaises(FeedError):
+            self.run_import()
+        self.assertEqual(Product.objects.filter(shop=self.shop).count(), 0)
+
+
+class YamlFeedReaderTests(TestCase):
+
+    def test_goods_are_streamed(self):
+        """
+        Streaming reader yields the same data as a full document load.
+        """
+        from backend.feeds import YamlFeedReader
+        data = load_price_list()
+        with open(os.path.join(settings.BASE_DIR, 'data', 'shop1.yaml'), 'rb') as data_shop:
+            reader = YamlFeedReader(data_shop)
+            self.assertEqual(reader.header, {'shop': data['shop'], 'categories': data['categories']})
+            self.assertEqual(list(reader.goods()), data['goods'])
+
+    def test_header_after_goods(self):
+        """
+        Keys placed after goods are still read into the header.
+        """
+        from backend.feeds import YamlFeedReader
+        reader = YamlFeedReader('goods:\n  - id: 1\n    name: &n test\n    model: *n\nshop: end\n')
+        self.assertEqual(list(reader.goods()), [{'id': 1, 'name': 'test', 'model': 'test'}])
+        self.assertEqual(reader.header, {'shop': 'end'})
+
+
+class FeedRequestHandler(BaseHTTPRequestHandler):
+    """
+    Local partner site serving data/shop1.yaml with an ETag.
+    """
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+        with open(os.path.join(settings.BASE_DIR, 'data', 'shop1.yaml'), 'rb') as data_shop:
+            body = data_shop.read()
+        if self.path == '/not-modified.yaml':
+            self.send_response(304)
+            self.end_headers()
+            return
+        if self.path == '/no-etag.yaml':
+            etag = None
+        else:
+            etag = '"shop1"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalFeedServerMixin:
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FeedRequestHandler)
+        cls.feed_url = f'http://127.0.0.1:{cls.server.server_port}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        settings_override = override_settings(FEED_CACHE_DIR=cache_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        FeedRequestHandler.requests = []
+        from backend.importer import parameter_cache
+        parameter_cache.clear()
+
+
+class FeedFetchTests(LocalFeedServerMixin, TestCase):
+
+    def test_etag_revalidation(self):
+        """
+        A second download sends If-None-Match and reuses the cached body on 304.
+        """
+        from backend.fetch import fetch_feed
+        feed = fetch_feed(f'{self.feed_url}/shop1.yaml')
+        self.assertTrue(feed.changed)
+        feed.mark_imported()
+
+        feed = fetch_feed(f'{self.feed_url}/shop1.yaml')
+        self.assertEqual(FeedRequestHandler.requests[-1].get('If-None-Match'), '"shop1"')
+        self.assertFalse(feed.changed)
+        self.assertTrue(os.path.exists(feed.path))
+
+    def test_unchanged_content_hash(self):
+        """
+        Without validators an identical body is detected by its hash.
+        """
+        from backend.fetch import fetch_feed
+        fetch_feed(f'{self.feed_url}/no-etag.yaml').mark_imported()
+        self.assertFalse(fetch_feed(f'{self.feed_url}/no-etag.yaml').changed)
+
+    def test_not_modified_without_cache(self):
+        """
+        A 304 for a request without validators is a download error.
+        """
+        from backend.fetch import FeedFetchError, fetch_feed
+        with self.assertRaises(FeedFetchError):
+            fetch_feed(f'{self.feed_url}/not-modified.yaml')
+
+    def test_queued_body_kept(self):
+        """
+        A new download keeps the previous body until the imports waiting for it are done.
+        """
+        from backend.fetch import FeedCache
+        cache = FeedCache(f'{self.feed_url}/shop1.yaml')
+        first = cache.store([b'first'], settings.FEED_MAX_SIZE)
+        cache.save(content_hash=first)
+        second = cache.store([b'second'], settings.FEED_MAX_SIZE)
+        cache.save(content_hash=second)
+        self.assertTrue(os.path.exists(cache.body_path(first)))
+
+        cache.prune([first])
+        self.assertTrue(os.path.exists(cache.body_path(first)))
+        cache.prune()
+        self.assertFalse(os.path.exists(cache.body_path(first)))
+        self.assertTrue(os.path.exists(cache.body_path(second)))
+
+    def test_max_size(self):
+        """
+        Price lists above FEED_MAX_SIZE are rejected.
+        """
+        from backend.fetch import FeedFetchError, fetch_feed
+        with self.settings(FEED_MAX_SIZE=100):
+            with self.assertRaises(FeedFetchError):
+                fetch_feed(f'{self.feed_url}/no-etag.yaml')
+
+    def test_fetch_many(self):
+        """
+        Several price lists are downloaded at once, failures are returned per url.
+        """
+        from backend.fetch import FeedFetchError, FetchedFeed, fetch_many
+        urls = [f'{self.feed_url}/{number}.yaml' for number in range(5)] + ['http://127.0.0.1:65500/shop1.yaml']
+        feeds = fetch_many(urls, max_workers=4, per_host=2)
+        self.assertEqual(list(feeds), urls)
+        self.assertTrue(all(isinstance(feeds[url], FetchedFeed) for url in urls[:-1]))
+        self.assertIsInstance(feeds[urls[-1]], FeedFetchError)
+
+
+class FeedFormatTests(TestCase):
+
+    def write(self, feed_format, goods=30):
+        from backend.feedgen import write_feed
+        text = io.StringIO(newline='')
+        write_feed(text, feed_format, goods)
+        return io.BytesIO(text.getvalue().encode())
+
+    def test_formats_read_same_goods(self):
+        """
+        Every format yields the same goods as the synthetic feed.
+        """
+        from backend.feedgen import synthetic_feed
+        from backend.feeds import JsonFeedReader, open_feed
+        header, goods = synthetic_feed(30)
+        goods = list(goods)
+        for feed_format in ('yaml', 'json', 'jsonl'):
+            reader = open_feed(self.write(feed_format))
+            self.assertEqual(reader.header, header)
+            self.assertEqual(list(reader.goods()), goods)
+
+        with mock.patch.object(JsonFeedReader, 'buffer_size', 7):
+            self.assertEqual(list(open_feed(self.write('json'), 'json').goods()), goods)
+
+        reader = open_feed(self.write('csv'))
+        self.assertEqual([(int(item['id']), item['price']) for item in reader.goods()],
+                         [(item['id'], item['price']) for item in goods])
+        self.assertEqual(reader.header, header)
+
+    def test_one_line_json(self):
+        """
+        A JSON document written on a single line is read as JSON, not as a JSON Lines header.
+        """
+        import json
+        from backend.feedgen import synthetic_feed
+        from backend.feeds import FeedError, JsonFeedReader, JsonLinesFeedReader, open_feed
+        header, goods = synthetic_feed(30)
+        goods = list(goods)
+        body = json.dumps({**header, 'goods': goods}).encode()
+        reader = open_feed(io.BytesIO(body))
+        self.assertIsInstance(reader, JsonFeedReader)
+        self.assertEqual(list(reader.goods()), goods)
+
+        with self.assertRaises(FeedError):
+            JsonLinesFeedReader(io.BytesIO(body))
+
+    def test_import_csv(self):
+        """
+        CSV price lists go through the same importer.
+        """
+        from backend.importer import import_feed, parameter_cache
+        from backend.models import Product, User
+        parameter_cache.clear()
+        user = User.objects.create_user(email='shop@mail.ru', password='Daiojkghrth86g', type='shop')
+        stats = import_feed(self.write('csv'), user.id, chunk_size=7)
+        self.assertEqual(stats['categories']['inserted'], 10)
+        self.assertEqual(stats['products']['inserted'], 30)
+        self.assertEqual(Product.objects.filter(external_id='30').count(), 1)
+
+
+class PartnerUpdateTests(LocalFeedServerMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        from backend.models import User
+        cls.user = User.objects.create_user(email='shop@mail.ru', password='Daiojkghrth86g', type='shop')
+
+    def setUp(self):
+        super().setUp()
+        # задачи импорта выполняются в процессе теста, без брокера
+        from orders.celery import app
+        for name in ('task_always_eager', 'task_eager_propagates'):
+            self.addCleanup(setattr, app.conf, name, app.conf[name])
+            setattr(app.conf, name, True)
+
+    def post_import(self, feed_url):
+        url = 'http://127.0.0.1:8000/api/v1/partner/update/'
+        response = self.client.post(url, {'url': feed_url}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        return self.client.get(f"{url}{response.json()['Task']}/")
+
+    def test_import_job(self):
+        """
+        Price list import runs as a job whose progress can be queried.
+        """
+        self.client.force_authenticate(self.user)
+        response = self.post_import(f'{self.feed_url}/shop1.yaml')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['stage'], 'done')
+        self.assertEqual(response.data['rows_processed'], 4)
+
+        response = self.post_import(f'{self.feed_url}/shop1.yaml')
+        self.assertEqual(response.data['stage'], 'unchanged')
+
+    def test_import_rate(self):
+        """
+        Import speed is measured from the start of the import stage, not from the download.
+        """
+        from datetime import timedelta
+        from django.utils import timezone
+        from backend.models import ImportRun, Shop
+        shop = Shop.objects.create(name='Связной', user=self.user)
+        now = timezone.now()
+        import_run = ImportRun.objects.create(user=self.user, url=f'{self.feed_url}/shop1.yaml', stage='importing',
+                                              started_at=now - timedelta(hours=1),
+                                              import_started_at=now - timedelta(seconds=10))
+        importer = mock.Mock(shop=shop, rows_processed=100, stats={})
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            import_run.report_progress(importer)
+        self.assertEqual(import_run.rows_per_sec, 10)
+
+    def test_import_failed(self):
+        """
+        Download errors are reported on the job instead of importing a stub price list.
+        """
+        self.client.force_authenticate(self.user)
+        response = self.post_import('http://127.0.0.1:65500/shop1.yaml')
+        self.assertEqual(response.data['stage'], 'failed')
+        self.assertTrue(response.data['errors'])
+
+
+class FeedSyncScheduleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        from backend.models import Shop, User
+        for number in range(3):
+            user = User.objects.create_user(email=f'shop{number}@mail.ru', password='Daiojkghrth86g', type='shop')
+            Shop.objects.create(name=f'shop{number}', user=user, url=f'https://shop{number}.ru/price.yaml')
+        Shop.objects.create(name='no url')
+
+    def test_staggered_and_coalesced(self):
+        """
+        Each shop gets one staggered sync, pending syncs are not duplicated.
+        """
+        from backend.models import ImportRun
+        from backend.tasks import schedule_feed_sync_task
+        with mock.patch('backend.tasks.fetch_feeds_task.apply_async') as apply_async:
+            self.assertEqual(schedule_feed_sync_task(), 3)
+            self.assertEqual(schedule_feed_sync_task(), 0)
+        self.assertEqual(ImportRun.objects.count(), 3)
+        countdowns = [call.kwargs['countdown'] for call in apply_async.call_args_list]
+        self.assertTrue(all(0 <= countdown < settings.FEED_SYNC_INTERVAL for countdown in countdowns))
+
+    @override_settings(FEED_SYNC_MAX_IMPORTS=1)
+    def test_import_slots(self):
+        """
+        Only FEED_SYNC_MAX_IMPORTS imports hold a slot, a run whose slot expired is marked failed.
+        """
+        from datetime import timedelta
+        from django.core.cache import cache
+        from django.utils import timezone
+        from backend.models import ImportRun, Shop
+        from backend.tasks import import_slot, schedule_feed_sync_task
+        cache.clear()
+        shop = Shop.objects.get(name='shop0')
+        started_at = timezone.now() - timedelta(seconds=settings.FEED_IMPORT_TIMEOUT + 1)
+        alive, crashed = [ImportRun.objects.create(user_id=shop.user_id, shop=shop, url=shop.url, stage='importing',
+                                                   started_at=started_at, import_started_at=started_at)
+                          for _ in range(2)]
+        with import_slot(alive.id) as slot:
+            self.assertIsNotNone(slot)
+            with import_slot(crashed.id) as other:
+                self.assertIsNone(other)
+            with mock.patch('backend.tasks.fetch_feeds_task.apply_async'):
+                schedule_feed_sync_task()
+        with import_slot(crashed.id) as slot:
+            self.assertIsNotNone(slot)
+
+        alive.refresh_from_db()
+        crashed.refresh_from_db()
+        self.assertEqual(alive.stage, 'importing')
+        self.assertEqual(crashed.stage, 'failed')
+
+    def test_worker_requires_shared_cache(self):
+        """
+        A prefork worker with several processes refuses to start on a process-local cache.
+        """
+        from django.core.exceptions import ImproperlyConfigured
+        from backend.tasks import require_shared_cache
+        with self.assertRaises(ImproperlyConfigured):
+            require_shared_cache(mock.Mock(concurrency=4, pool_cls='prefork'))
+        require_shared_cache(mock.Mock(concurrency=1, pool_cls='prefork'))
+        require_shared_cache(mock.Mock(concurrency=20, pool_cls='threads'))
+        with mock.patch('backend.tasks.cache_is_shared', return_value=True):
+            require_shared_cache(mock.Mock(concurrency=4, pool_cls='prefork'))
+
+
+class PartnerStockTests(PriceListFixture, APITestCase):
+
+    def test_json_delta(self):
+        """
+        Quantity and price changes are applied by external id, unknown ids are reported.
+        """
+        from backend.models import Product
+        self.client.force_authenticate(self.user)
+        url = 'http://127.0.0.1:8000/api/v1/partner/stock/'
+        data = {'items': [['4216292', 3, 100000, None], ['4216313', 0], ['4216226', None], ['404', 1, 1, 1]]}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.json(), {'Status': True, 'Updated': 2, 'Missing': ['404']})
+        product = Product.objects.get(external_id='4216292')
+        self.assertEqual((product.quantity, product.price, product.price_rrc), (3, 100000, 116990))
+        self.assertEqual(Product.objects.get(external_id='4216313').quantity, 0)
+
+    def test_csv_delta(self):
+        """
+        The same delta can be sent as CSV.
+        """
+        from backend.models import Product
+        self.client.force_authenticate(self.user)
+        url = 'http://127.0.0.1:8000/api/v1/partner/stock/'
+        body = 'external_id,quantity,price,price_rrc\n4216226,1,,\n'
+        response = self.client.post(url, body, content_type='text/csv')
+        self.assertEqual(response.json(), {'Status': True, 'Updated': 1, 'Missing': []})
+        self.assertEqual(Product.objects.get(external_id='4216226').quantity, 1)
+
+        response = self.client.post(url, '4216226,-1\n', content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(url, f'4216226,{10 ** 12}\n', content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class KeysetPaginationTests(CatalogFixture, APITestCase):
+
+    def collect(self, url, key):
+        items, pages = [], 0
+        while url:
+            data = self.client.get(url).json()
+            self.assertNotIn('count', data)
+            items.extend(data[key])
+            url = data['next']
+            pages += 1
+        return items, pages
+
+    def test_products(self):
+        """
+        Products are walked by opaque cursor in id order without gaps or repeats.
+        """
+        from backend.models import Product
+        items, pages = self.collect('http://127.0.0.1:8000/api/v1/products/?pagination=cursor&page_size=3', 'results')
+        self.assertEqual([item['name'] for item in items],
+                         list(Product.objects.order_by('id').values_list('name', flat=True)))
+        self.assertEqual(pages, 2)
+
+        response = self.client.get('http://127.0.0.1:8000/api/v1/products/')
+        self.assertIn('count', response.json())
+
+    def test_orders(self):
+        """
+        Buyer orders are walked newest first.
+        """
+        from backend.models import Order
+        self.client.force_authenticate(self.buyer)
+        items, pages = self.collect('http://127.0.0.1:8000/api/v1/order/?pagination=cursor&page_size=2', 'orders')
+        self.assertEqual([item['id'] for item in items],
+                         list(Order.objects.order_by('-dt', 'id').values_list('id', flat=True)))
+        self.assertEqual(pages, 2)
+
+
+class ProductSearchTests(PriceListFixture, APITestCase):
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def search(self, query):
+        response = self.client.get('http://127.0.0.1:8000/api/v1/products/search/', {'q': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['name'] for item in response.json()['results']]
+
+    def test_search(self):
+        """
+        Words are matched by prefix in name, model and parameter values.
+        """
+        self.assertEqual(len(self.search('iphone')), 4)
+        # у синего XR 256 только в параметрах, совпадение в названии ранжируется выше
+        self.assertEqual(self.search('xr 256'), ['Смартфон Apple iPhone XR 256GB (красный)',
+                                                 'Смартфон Apple iPhone XR 256GB (черный)',
+                                                 'Смартфон Apple iPhone XR 128GB (синий)'])
+        self.assertEqual(self.search('золотист'), ['Смартфон Apple iPhone XS Max 512GB (золотистый)'])
+        self.assertEqual(self.search('синий'), ['Смартфон Apple iPhone XR 128GB (синий)'])
+        self.assertEqual(self.search('nokia'), [])
+
+    def test_index_follows_import(self):
+        """
+        Re-imported and manually added products are searchable right away.
+        """
+        from backend.importer import PriceListImporter
+        self.assertEqual(self.search('nokia'), [])
+        self.data['goods'][0]['name'] = 'Смартфон Samsung Galaxy'
+        with self.captureOnCommitCallbacks(execute=True):
+            PriceListImporter(self.shop).run(self.data['categories'], self.data['goods'])
+        self.assertEqual(self.search('galaxy'), ['Смартфон Samsung Galaxy'])
+        self.assertNotIn('Смартфон Apple iPhone XS Max 512GB (золотистый)', self.search('iphone'))
+
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('http://127.0.0.1:8000/api/v1/products/write/', {
+                'model': 'nokia/3310', 'name': 'Телефон Nokia 3310', 'quantity': 1, 'price': 1, 'price_rrc': 1,
+                'category': self.data['categories'][0]['id'], 'shop': self.shop.id,
+            })
+        self.assertEqual(self.search('nokia'), ['Телефон Nokia 3310'])
+
+
+class FacetIndexTests(PriceListFixture, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_shop()
+
+    def setUp(self):
+        from django.core.cache import cache
+        from backend.facets import facet_index
+        cache.clear()
+        facet_index.reset()
+        # индекс фасетов собирается из журнала изменений импорта, поэтому прайс загружается в каждом тесте
+        self.import_price_list()
+
+    def facets(self, **params):
+        response = self.client.get('http://127.0.0.1:8000/api/v1/products/facets/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_facet_counts(self):
+        """
+        Facet counts ignore the filter of their own parameter and honour the others.
+        """
+        data = self.facets(parameter=['Цвет:черный'])
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['facets']['Цвет'], {'золотистый': 1, 'красный': 1, 'черный': 1, 'синий': 1})
+        self.assertEqual(data['facets']['Встроенная память (Гб)'], {'256': 1})
+
+        data = self.facets(parameter=['Встроенная память (Гб):256', 'Цвет:черный', 'Цвет:синий'])
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(self.facets(category=self.data['goods'][0]['category'])['count'], 4)
+
+        response = self.client.get('http://127.0.0.1:8000/api/v1/products/', {'parameter': 'Цвет:красный'})
+        self.assertEqual([item['name'] for item in response.json()['results']],
+                         ['Смартфон Apple iPhone XR 256GB (красный)'])
+
+    def test_incremental_update(self):
+        """
+        Re-imported goods are picked up from the change log without a full rebuild.
+        """
+        from backend.facets import facet_index
+        from backend.importer import PriceListImporter
+        self.facets()
+        self.data['goods'][0]['parameters']['Цвет'] = 'черный'
+        with self.captureOnCommitCallbacks(execute=True):
+            PriceListImporter(self.shop).run(self.data['categories'], self.data['goods'])
+        with mock.patch.object(facet_index, 'rebuild') as rebuild:
+            data = self.facets()
+        rebuild.assert_not_called()
+        self.assertEqual(data['facets']['Цвет'], {'красный': 1, 'черный': 2, 'синий': 1})
+
+    def test_broad_filter_uses_join(self):
+        """
+        Filters matching more products than FACET_FILTER_MAX_IDS select them by subquery with the same result.
+        """
+        url = 'http://127.0.0.1:8000/api/v1/products/'
+        params = {'parameter': ['Встроенная память (Гб):256', 'Цвет:черный', 'Цвет:синий']}
+        expected = self.client.get(url, params).json()['results']
+        with self.settings(FACET_FILTER_MAX_IDS=1), CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(url, {**params, 'page_size': 20}).json()['results'], expected)
+        self.assertTrue(captured_sql(context, 'backend_productparameter'))
+
+    def test_saved_products(self):
+        """
+        Products deleted or edited outside the importer leave the facet index through post_delete/post_save.
+        """
+        from backend.models import Product
+        self.assertEqual(self.facets()['count'], 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(external_id='4216292').delete()
+        self.assertEqual(self.facets()['count'], 3)
+
+    def test_renamed_parameter(self):
+        """
+        A parameter renamed in the admin is shown and filtered by its new name.
+        """
+        from backend.models import Parameter
+        self.facets()
+        parameter = Parameter.objects.get(name='Цвет')
+        parameter.name = 'Окраска'
+        with self.captureOnCommitCallbacks(execute=True):
+            parameter.save()
+        data = self.facets(parameter=['Окраска:черный'])
+        self.assertNotIn('Цвет', data['facets'])
+        self.assertEqual(data['count'], 1)
+
+    def test_range_filter(self):
+        """
+        Products are filtered by numeric parameter ranges with open bounds.
+        """
+        url = 'http://127.0.0.1:8000/api/v1/products/'
+        response = self.client.get(url, {'range': 'Встроенная память (Гб):300:'})
+        self.assertEqual([item['name'] for item in response.json()['results']],
+                         ['Смартфон Apple iPhone XS Max 512GB (золотистый)'])
+        response = self.client.get(url, {'range': ['Встроенная память (Гб):200:256', 'Диагональ (дюйм):6:6.2']})
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(self.client.get(url, {'range': 'Вес:1:2'}).json()['count'], 0)
+        self.assertEqual(self.client.get(url, {'range': 'Вес:a:2'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class QueryBudgetTests(CatalogFixture, APITestCase):
+    """
+    Each endpoint has a fixed budget of SQL queries that does not grow with the number of rows on a page.
+    """
+
+    def assertQueryBudget(self, url, budget):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # запросы профилировщика silk (с их EXPLAIN) и точки сохранения транзакций в бюджет не входят
+        queries = captured_sql(context, table='')
+        self.assertLessEqual(len(queries), budget, '\n'.join(queries))
+        return response
+
+    def test_products(self):
+        """
+        Product list: count, products, shops, categories, parameters.
+        """
+        response = self.assertQueryBudget('http://127.0.0.1:8000/api/v1/products/', 5)
+        self.assertEqual(len(response.json()['results'][0]['parameter']), 4)
+        self.assertQueryBudget('http://127.0.0.1:8000/api/v1/products/?pagination=cursor', 4)
+
+    def test_basket(self):
+        """
+        Basket list: count, basket rows, shops, products with their shops, categories and parameters.
+        """
+        self.client.force_authenticate(self.buyer)
+        self.assertQueryBudget('http://127.0.0.1:8000/api/v1/basket/', 7)
+
+    def test_orders(self):
+        """
+        Order list: orders and their total; order detail: one query.
+        """
+        self.client.force_authenticate(self.buyer)
+        self.assertQueryBudget('http://127.0.0.1:8000/api/v1/order/', 2)
+        self.assertQueryBudget(f'http://127.0.0.1:8000/api/v1/order/{self.order.id}/', 1)
+
+
+class CompiledSerializerTests(CatalogFixture, APITestCase):
+
+    def assertSameJson(self, serializer_class, queryset):
+        from rest_framework.renderers import JSONRenderer
+        from backend.compiled import compile_serializer
+        compiled = compile_serializer(serializer_class)
+        expected = JSONRenderer().render(serializer_class(queryset, many=True).data)
+        self.assertEqual(JSONRenderer().render(compiled.serialize(compiled.values(queryset))), expected)
+
+    def test_same_output(self):
+        """
+        Compiled serializers render byte-identical JSON to the DRF serializers.
+        """
+        from backend.models import Basket, Order
+        from backend.serializers import BasketSerializer, OrderSerializer, ProductSerializer
+        from backend.views import ProductViewSet
+        self.assertSameJson(ProductSerializer, ProductViewSet.queryset)
+        self.assertSameJson(OrderSerializer, Order.objects.all())
+        self.assertSameJson(BasketSerializer, Basket.objects.order_by('id'))
+
+    def test_not_compilable(self):
+        """
+        Fields the compiler does not understand are rejected up front.
+        """
+        from django.core.exceptions import ImproperlyConfigured
+        from rest_framework import serializers
+        from backend.compiled import CompiledSerializer
+        from backend.models import Order
+
+        class OrderTotalSerializer(serializers.ModelSerializer):
+            total = serializers.SerializerMethodField()
+
+            class Meta:
+                model = Order
+                fields = ('id', 'total')
+
+        with self.assertRaises(ImproperlyConfigured):
+            CompiledSerializer(OrderTotalSerializer)
+
+
+class CatalogCacheTests(CatalogFixture, APITestCase):
+
+    def get(self, url, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        queries = captured_sql(context)
+        return response.json(), len(queries)
+
+    def test_write_invalidates(self):
+        """
+        Cached catalog pages are served without queries until a write bumps their version.
+        """
+        url = 'http://127.0.0.1:8000/api/v1/products/'
+        first, _ = self.get(url)
+        second, queries = self.get(url)
+        self.assertEqual((second, queries), (first, 0))
+
+        self.client.force_authenticate(self.shop.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('http://127.0.0.1:8000/api/v1/partner/stock/', {'items': [['4216292', 7]]}, format='json')
+        data, queries = self.get(url)
+        self.assertGreater(queries, 0)
+        self.assertIn(7, [item['quantity'] for item in data['results']])
+
+    def test_stale_keeps_etag(self):
+        """
+        A stale body served while another worker recomputes carries the ETag it was built under.
+        """
+        from django.core.cache import cache
+        url = 'http://127.0.0.1:8000/api/v1/products/'
+        response = self.client.get(url)
+        etag, quantities = response['ETag'], [item['quantity'] for item in response.json()['results']]
+
+        self.client.force_authenticate(self.shop.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('http://127.0.0.1:8000/api/v1/partner/stock/', {'items': [['4216292', 7]]}, format='json')
+        add = cache.add
+        with mock.patch.object(cache, 'add', lambda key, *args, **kwargs: False if key.startswith('catalog:lock:')
+                               else add(key, *args, **kwargs)):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual([item['quantity'] for item in response.json()['results']], quantities)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn(7, [item['quantity'] for item in response.json()['results']])
+
+    def test_scoped_versions(self):
+        """
+        Changes in one shop keep cached pages filtered by other shops and the category list.
+        """
+        from backend.models import Category, Product, Shop, User
+        other = Shop.objects.create(name='Евросеть', user=User.objects.create_user(
+            email='other@mail.ru', password='Daiojkghrth86g', type='shop'))
+        Product.objects.create(model='nokia/3310', name='Телефон Nokia 3310', quantity=1, price=1, price_rrc=1,
+                               category_id=224, shop=other)
+        url = 'http://127.0.0.1:8000/api/v1/products/'
+        first, _ = self.get(url, {'shop': other.id})
+        self.get(url, {'shop': self.shop.id})
+        self.client.force_authenticate(self.shop.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('http://127.0.0.1:8000/api/v1/partner/stock/', {'items': [['4216292', 7]]}, format='json')
+        self.assertEqual(self.get(url, {'shop': other.id}), (first, 0))
+        data, queries = self.get(url, {'shop': self.shop.id})
+        self.assertGreater(queries, 0)
+        self.assertIn(7, [item['quantity'] for item in data['results']])
+
+        url = 'http://127.0.0.1:8000/api/v1/category/'
+        self.get(url)
+        category = Category.objects.get(id=224)
+        category.name = 'Телефоны'
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+        data, _ = self.get(url)
+        self.assertIn({'name': 'Телефоны'}, data['results'])
+
+    def test_filtered_pages_follow_related_edits(self):
+        """
+        Filtered product pages pick up renamed categories, shops and parameters edited in the admin.
+        """
+        from backend.models import Category, Parameter, ProductParameter
+        url = 'http://127.0.0.1:8000/api/v1/products/'
+        self.get(url, {'shop': self.shop.id})
+        self.get(url, {'category': 224})
+
+        category = Category.objects.get(id=224)
+        category.name = 'Телефоны'
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+        data, _ = self.get(url, {'shop': self.shop.id})
+        self.assertIn('Телефоны', [item['category'] for item in data['results']])
+
+        self.shop.name = 'Евросеть'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shop.save()
+        data, _ = self.get(url, {'category': 224})
+        self.assertEqual({item['shop'] for item in data['results']}, {f'Евросеть {self.shop.id}'})
+
+        parameter = ProductParameter.objects.filter(parameter__name='Цвет').first()
+        parameter.value = 'оранжевый'
+        with self.captureOnCommitCallbacks(execute=True):
+            parameter.save()
+        data, _ = self.get(url, {'shop': self.shop.id})
+        values = [item['value'] for product in data['results'] for item in product['parameter']]
+        self.assertIn('оранжевый', values)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Parameter.objects.filter(name='Цвет').update(name='Окраска')
+            Parameter.objects.get(name='Окраска').save()
+        data, _ = self.get(url, {'category': 224})
+        names = {item['name'] for product in data['results'] for item in product['parameter']}
+        self.assertIn('Окраска', names)
+
+
+class SingleFlightTests(TestCase):
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_burst_computes_once(self):
+        """
+        A burst of concurrent misses for the same key runs the computation once.
+        """
+        from backend.cache import single_flight
+        calls, results = [], []
+        barrier = threading.Barrier(8)
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'count': 1}
+
+        def request():
+            barrier.wait()
+            results.append(single_flight('catalog:test', compute))
+
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'count': 1}] * 8)
+
+    def test_other_process_holds_lock(self):
+        """
+        While another process recomputes, the previous value is served, or the new one is awaited.
+        """
+        from django.core.cache import cache
+        from backend.cache import LOCK_KEY, single_flight
+        cache.add(LOCK_KEY.format('catalog:test'), 'other', timeout=30)
+        compute = mock.Mock(return_value={'count': 2})
+        cache.set('catalog:stale', {'count': 1})
+        self.assertEqual(single_flight('catalog:test', compute, 'catalog:stale'), {'count': 1})
+
+        timer = threading.Timer(0.1, cache.set, ('catalog:test', {'count': 3}))
+        timer.start()
+        self.assertEqual(single_flight('catalog:test', compute), {'count': 3})
+        timer.join()
+        compute.assert_not_called()
+
+
+class ConditionalGetTests(CatalogFixture, APITestCase):
+
+    def assertNotModified(self, url, **headers):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        return captured_sql(context)
+
+    def test_catalog_etag(self):
+        """
+        Catalog ETags come from data versions: a matching If-None-Match is answered without queries.
+        """
+        url = 'http://127.0.0.1:8000/api/v1/products/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.assertNotModified(url, HTTP_IF_NONE_MATCH=etag), [])
+
+        self.client.force_authenticate(self.shop.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('http://127.0.0.1:8000/api/v1/partner/stock/', {'items': [['4216292', 7]]}, format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_orders_validators(self):
+        """
+        The order list is validated by max(updated_at) before serialization.
+        """
+        from backend.models import Order
+        url = 'http://127.0.0.1:8000/api/v1/order/'
+        self.client.force_authenticate(self.buyer)
+        response = self.client.get(url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(len(self.assertNotModified(url, HTTP_IF_NONE_MATCH=etag)), 1)
+        self.assertNotModified(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        Order.objects.filter(id=self.order.id).update(status='confirmed', updated_at=self.order.updated_at.replace(
+            year=self.order.updated_at.year + 1))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('confirmed', [order['status'] for order in response.json()['orders']])
+
+
+class CatalogExportTests(CatalogFixture, APITestCase):
+
+    def test_ndjson(self):
+        """
+        NDJSON export streams every product with its parameters inlined, one query per chunk for parameters.
+        """
+        import json
+        import math
+        from backend.export import export_rows
+        from backend.models import Product
+        response = self.client.get('http://127.0.0.1:8000/api/v1/products/export/', {'shop': self.shop.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        items = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        product = Product.objects.get(external_id='4216292')
+        self.assertEqual(len(items), Product.objects.count())
+        item = next(item for item in items if item['id'] == product.id)
+        self.assertEqual(item['parameters'], {parameter.parameter.name: parameter.value
+                                              for parameter in product.product_parameters.all()})
+
+        with CaptureQueriesContext(connection) as context:
+            rows = list(export_rows(Product.objects.all(), chunk_size=2))
+        queries = captured_sql(context)
+        self.assertEqual(rows, items)
+        self.assertEqual(len(queries), 1 + math.ceil(len(rows) / 2))
+
+    def test_csv(self):
+        """
+        CSV export has a column per parameter and honours the catalog filters.
+        """
+        import csv
+        from backend.models import Product
+        response = self.client.get('http://127.0.0.1:8000/api/v1/products/export/', {'output': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertIn('Цвет', rows[0])
+        self.assertEqual(rows[0][:3], ['id', 'external_id', 'name'])
+        self.assertEqual(len(rows) - 1, Product.objects.count())
+
+        response = self.client.get('http://127.0.0.1:8000/api/v1/products/export/', {'output': 'csv', 'category': 224})
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(len(rows) - 1, Product.objects.filter(category_id=224).count())
+        response = self.client.get('http://127.0.0.1:8000/api/v1/products/export/', {'output': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SparseFieldsTests(CatalogFixture, APITestCase):
+
+    def get(self, url, params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        queries = captured_sql(context)
+        return response, queries
+
+    def test_products(self):
+        """
+        ?fields= and ?exclude= trim the payload and the selected columns; nested objects are not loaded.
+        """
+        url = 'http://127.0.0.1:8000/api/v1/products/'
+        response, queries = self.get(url, {'fields': 'name,price'})
+        self.assertEqual([set(item) for item in response.json()['results']], [{'name', 'price'}] * 4)
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn('"backend_product"."quantity"', queries[-1])
+
+        response, queries = self.get(url, {'exclude': 'parameter,shop'})
+        item = response.json()['results'][0]
+        self.assertNotIn('parameter', item)
+        self.assertIn('category', item)
+        self.assertFalse([query for query in queries if 'backend_productparameter' in query or 'backend_shop' in query])
+
+        response, _ = self.get(url, {'fields': 'name,owner'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_orders_cursor(self):
+        """
+        Cursor pages of orders still link to the next page when the ordering columns are not requested.
+        """
+        self.client.force_authenticate(self.buyer)
+        response, _ = self.get('http://127.0.0.1:8000/api/v1/order/',
+                               {'pagination': 'cursor', 'page_size': 2, 'fields': 'status'})
+        data = response.json()
+        self.assertEqual(data['orders'], [{'status': 'new'}] * 2)
+        self.assertIsNotNone(data['next'])
+
+
+class ProductBatchTests(CatalogFixture, APITestCase):
+
+    def test_batch(self):
+        """
+        Products come back in the requested order with missing ids reported, in a fixed number of queries.
+        """
+        from backend.models import Product
+        url = 'http://127.0.0.1:8000/api/v1/products/batch/'
+        ids = list(Product.objects.order_by('-id').values_list('id', flat=True))
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, {'ids': ','.join(map(str, ids + [999]))})
+        queries = captured_sql(context)
+        data = response.json()
+        self.assertEqual([item['id'] for item in data['results']], ids)
+        self.assertEqual(data['missing'], [999])
+        self.assertEqual(len(data['results'][0]['parameter']), 4)
+        self.assertEqual(len(queries), 4)
+
+        detail = self.client.get(f'http://127.0.0.1:8000/api/v1/products/{ids[0]}/').json()
+        self.assertEqual(data['results'][0], {'id': ids[0], **detail})
+
+        response = self.client.post(url, {'ids': [ids[1], ids[0]]}, format='json')
+        self.assertEqual([item['id'] for item in response.json()['results']], [ids[1], ids[0]])
+
+        response = self.client.get(url, {'ids': 'a,b'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with self.settings(PRODUCT_BATCH_MAX_IDS=2):
+            response = self.client.get(url, {'ids': '1,2,3'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BestOfferTests(CatalogFixture, APITestCase):
+
+    def offers(self):
+        response = self.client.get('http://127.0.0.1:8000/api/v1/products/offers/', {'model': 'apple/iphone/xr'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_offers_follow_stock(self):
+        """
+        Best offers are ranked by price at import and updated by stock changes.
+        """
+        data = self.offers()
+        self.assertEqual(data['min_price'], 60000)
+        self.assertEqual([offer['price'] for offer in data['offers']], [60000, 65000, 65000])
+
+        self.client.force_authenticate(self.shop.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('http://127.0.0.1:8000/api/v1/partner/stock/',
+                             {'items': [['4672670', 0], ['4216226', 5, 55000]]}, format='json')
+        data = self.offers()
+        self.assertEqual(data['min_price'], 55000)
+        self.assertEqual([offer['quantity'] for offer in data['offers']], [5, 9])
+
+    def test_model_change(self):
+        """
+        A product moved to another model leaves the offers of its previous model.
+        """
+        from backend.models import BestOffer, Product
+        product = Product.objects.get(external_id='4672670')
+        product.model = 'apple/iphone/11'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(list(BestOffer.objects.filter(model='apple/iphone/xr').values_list('price', flat=True)),
+                         [65000, 65000])
+        self.assertEqual(BestOffer.objects.get(model='apple/iphone/11').product, product)
+        self.assertEqual(self.client.get('http://127.0.0.1:8000/api/v1/products/offers/').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_fresh_after_import(self):
+        """
+        Offers cached while an import commits are replaced once the offers are rebuilt after it.
+        """
+        from backend.importer import PriceListImporter
+        data = self.data
+        for item in data['goods']:
+            item['price'] += 10000
+        with self.captureOnCommitCallbacks() as callbacks:
+            PriceListImporter(self.shop).run(data['categories'], data['goods'])
+        # последним после фиксации идет пересчет лучших предложений, до него версия products уже новая
+        for callback in callbacks[:-1]:
+            callback()
+        self.assertEqual(self.offers()['min_price'], 60000)
+        with self.captureOnCommitCallbacks(execute=True):
+            callbacks[-1]()
+        self.assertEqual(self.offers()['min_price'], 70000)
+
+    def test_rebuilt_once(self):
+        """
+        A chunked import and a product write each rebuild the offers once, after commit.
+        """
+        from backend.importer import PriceListImporter
+        data = self.data
+        for item in data['goods']:
+            item['price'] -= 1
+        with mock.patch('backend.offers.rebuild_offers') as rebuild:
+            with self.captureOnCommitCallbacks() as callbacks:
+                PriceListImporter(self.shop, chunk_size=1).run(data['categories'], data['goods'])
+            rebuild.assert_not_called()
+            for callback in callbacks:
+                callback()
+            self.assertEqual(rebuild.call_count, 1)
+            self.assertIn('apple/iphone/xr', rebuild.call_args[0][0])
+
+            rebuild.reset_mock()
+            self.client.force_authenticate(self.shop.user)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('http://127.0.0.1:8000/api/v1/products/write/', {
+                    'model': 'apple/iphone/11', 'name': 'Смартфон Apple iPhone 11', 'quantity': 3, 'price': 50000,
+                    'price_rrc': 52000, 'category': 224, 'shop': self.shop.id}, format='json')
+            self.assertEqual(rebuild.call_count, 1)
+
+
+class SuggestIndexTests(CatalogFixture, APITestCase):
+
+    def setUp(self):
+        from backend.suggest import suggest_index
+        super().setUp()
+        suggest_index.reset()
+
+    def suggest(self, query):
+        response = self.client.get('http://127.0.0.1:8000/api/v1/products/suggest/', {'q': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()['suggestions']
+
+    def test_prefixes(self):
+        """
+        Any word of a product name, model or category name can be completed; warm lookups skip the database.
+        """
+        from backend.suggest import suggest_index
+        self.assertIn({'text': 'apple/iphone/xr', 'type': 'model'}, self.suggest('iphone x'))
+        self.assertIn({'text': 'Смартфоны', 'type': 'category'}, self.suggest('смарт'))
+        self.assertEqual(self.suggest('  '), [])
+
+        visited = []
+
+        class Keys(list):
+            def __getitem__(self, item):
+                result = super().__getitem__(item)
+                if isinstance(item, slice):
+                    visited.append(len(result))
+                return result
+
+        suggest_index.keys = Keys(suggest_index.keys)
+        with CaptureQueriesContext(connection) as context, self.settings(SUGGEST_SCAN_FACTOR=2):
+            suggestions = suggest_index.suggest('смартфон', limit=2)
+        self.assertEqual(captured_sql(context), [])
+        # короткий префикс совпадает с пятью текстами, но просматривается не больше limit * SUGGEST_SCAN_FACTOR ключей
+        self.assertEqual(len(suggestions), 2)
+        self.assertEqual(visited, [4])
+
+    def test_incremental_refresh(self):
+        """
+        A fresh process loads the snapshot without queries and then applies logged catalog changes.
+        """
+        from backend.models import Product
+        from backend.suggest import suggest_index
+        self.suggest('iph')
+        product = Product.objects.get(external_id='4216292')
+        product.name = 'Samsung Galaxy S9'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+        suggest_index.reset()
+        with CaptureQueriesContext(connection) as context:
+            suggest_index.rebuild()
+        self.assertEqual(captured_sql(context), [])
+        self.assertEqual(self.suggest('galax'), [{'text': 'Samsung Galaxy S9', 'type': 'product'}])
+
+    @override_settings(SUGGEST_SNAPSHOT_INTERVAL=1)
+    def test_snapshot_follows_log(self):
+        """
+        Applying the change log rewrites the snapshot, so new processes start from it without the log.
+        """
+        from django.core.cache import cache
+        from backend.models import Product
+        from backend.suggest import LOG_ENTRY_KEY, LOG_SEQUENCE_KEY, suggest_index
+        self.suggest('iph')
+        product = Product.objects.get(external_id='4216292')
+        product.name = 'Samsung Galaxy S9'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.suggest('iph')
+        cache.delete(LOG_ENTRY_KEY.format(cache.get(LOG_SEQUENCE_KEY)))
+
+        suggest_index.reset()
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(suggest_index.suggest('galax'), [{'text': 'Samsung Galaxy S9', 'type': 'product'}])
+        self.assertEqual(captured_sql(context), [])
+
+    def test_batched_refresh(self):
+        """
+        A price-only import is not logged for suggestions; a refresh skips unchanged products and merges a
+        large batch of keys into the same index a rebuild would produce.
+        """
+        from django.core.cache import cache
+        from backend.importer import PriceListImporter
+        from backend.models import Product
+        from backend.suggest import LOG_SEQUENCE_KEY, SNAPSHOT_KEY, SuggestIndex, suggest_index
+        self.suggest('iph')
+        sequence = cache.get(LOG_SEQUENCE_KEY, 0)
+        for item in self.data['goods']:
+            item['price'] += 1
+        with self.captureOnCommitCallbacks(execute=True):
+            PriceListImporter(self.shop).run(self.data['categories'], self.data['goods'])
+        self.assertEqual(cache.get(LOG_SEQUENCE_KEY, 0), sequence)
+
+        product_ids = list(Product.objects.values_list('id', flat=True))
+        with mock.patch.object(suggest_index, '_set_product') as set_product:
+            suggest_index.refresh(product_ids)
+        set_product.assert_not_called()
+
+        Product.objects.filter(external_id='4216292').update(name='Samsung Galaxy S9')
+        with self.settings(SUGGEST_INSORT_LIMIT=0):
+            suggest_index.refresh(product_ids)
+        cache.delete(SNAPSHOT_KEY)
+        rebuilt = SuggestIndex()
+        rebuilt.rebuild()
+        self.assertEqual(suggest_index.keys, rebuilt.keys)
+        self.assertEqual(suggest_index.suggest('galax'), [{'text': 'Samsung Galaxy S9', 'type': 'product'}])
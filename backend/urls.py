@@ -6,7 +6,8 @@ from django.conf.urls import include
 
 
 from backend.views import RegisterAccount, ConfirmAccount, LoginAccount, CategoryViewSet, ProductViewSet, ShopViewSet, \
-    OrderViewSet, BasketViewSet, PartnerUpdate, ContactView
+    OrderViewSet, BasketViewSet, PartnerUpdate, PartnerUpdateStatus, PartnerStock, \
+    ContactView
 
 r = DefaultRouter()
 r.register('category', CategoryViewSet)
@@ -19,6 +20,8 @@ r.register('basket', BasketViewSet)
 app_name = 'backend'
 urlpatterns = [
     path('partner/update/', PartnerUpdate.as_view(), name='partner-update'),
+    path('partner/update/<int:pk>/', PartnerUpdateStatus.as_view(), name='partner-update-status'),
+    path('partner/stock/', PartnerStock.as_view(), name='partner-stock'),
     path('user/register/', RegisterAccount.as_view(), name='user-register'),
     path('user/register/confirm/', ConfirmAccount.as_view(), name='user-register-confirm'),
     path('user/login/', LoginAccount.as_view(), name='user-login'),
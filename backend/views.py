@@ -1,20 +1,37 @@
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.core.validators import URLValidator
-from django.db import IntegrityError
-from django.db.models import Sum
+from django.db.models import Count, Max, Prefetch, Q, Sum
+from django.utils import timezone
 from rest_framework.decorators import action
 from rest_framework import status
 from rest_framework.exceptions import ValidationError, PermissionDenied
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.authtoken.models import Token
-from backend.models import Category, Product, Shop, ConfirmEmailToken, Order, Basket, Contact, ProductParameter, User
+from backend.models import Category, Product, Shop, ConfirmEmailToken, Order, Basket, Contact, User, ImportRun, \
+    ProductParameter, BestOffer, FEED_FORMAT_CHOICES
 from backend.serializers import RegistrationSerializer, CategorySerializer, ProductSerializer, ShopSerializer, \
-    OrderSerializer, BasketSerializer, ContactSerializer, OrderItemSerializer
-from django.http import JsonResponse
-from backend.tasks import send_email_task, shop_data_task
+    OrderSerializer, BasketSerializer, ContactSerializer, OrderItemSerializer, ImportRunSerializer
+from django.http import JsonResponse, StreamingHttpResponse
+from backend.tasks import send_email_task, fetch_feeds_task
+from backend.stock import CsvDeltaParser, apply_stock_delta, parse_delta
+from backend.search import search_product_ids
+from backend.facets import facet_index, filter_by_parameters, parse_parameter_filters
+from backend.suggest import suggest_index
+from backend.offers import deferred_offers
+from backend.filters import filter_parameter_ranges, parse_range_filters
+from backend.compiled import CompiledListMixin, compile_serializer, project_for_request
+from backend.pagination import ordering_columns
+from backend.export import EXPORT_FORMATS, export_csv, export_ndjson
+from backend.cache import CachedCatalogMixin, cached_response
+from backend.conditional import make_etag, not_modified, set_validators
+from backend.signals import catalog_updated
 
 from rest_framework.throttling import UserRateThrottle, AnonRateThrottle
 
@@ -150,12 +167,13 @@ class LoginAccount(APIView):
         return JsonResponse({'Status': False, 'Errors': 'All necessary arguments are not specified'})
 
 
-class CategoryViewSet(ModelViewSet):
+class CategoryViewSet(CachedCatalogMixin, ModelViewSet):
     """
     Класс для просмотра категорий (сделано)
     """
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    cache_scope = 'categories'
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -170,12 +188,13 @@ class CategoryViewSet(ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
 
-class ShopViewSet(ModelViewSet):
+class ShopViewSet(CachedCatalogMixin, ModelViewSet):
     """
     Класс для просмотра списка магазинов (сделано)
     """
     queryset = Shop.objects.all()
     serializer_class = ShopSerializer
+    cache_scope = 'shops'
 
     @action(methods=['GET'], detail=True, throttle_classes=[UserRateThrottle])
     def state(self, request, pk=None):
@@ -198,13 +217,35 @@ class ShopViewSet(ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(CachedCatalogMixin, CompiledListMixin, ModelViewSet):
     """
     Класс для просмотра и создания списка продуктов
     """
-    queryset = Product.objects.all()
+    # shop, category и параметры выводит ProductSerializer, загружаем их заранее, а не запросом на каждый товар
+    queryset = Product.objects.select_related('shop', 'category').prefetch_related(
+        Prefetch('product_parameters', queryset=ProductParameter.objects.select_related('parameter').order_by('id'))
+    ).order_by('id')
     serializer_class = ProductSerializer
     filterset_fields = ['category', 'shop']
+    cursor_ordering = 'id'
+    cache_scope = 'products'
+    cache_name_scopes = ('categories', 'shops', 'parameters')
+    cache_filter_scopes = ('shop', 'category')
+
+    def cache_scopes(self, request):
+        if self.action == 'offers':
+            # лучшие предложения пересчитываются после сброса версии products и сбрасывают свою версию offers
+            return ['shops', self.cache_scope, 'offers']
+        return super().cache_scopes(request)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        # ?parameter=Цвет:черный - отбор по фасетному индексу
+        parameters = parse_parameter_filters(self.request.query_params.getlist('parameter'))
+        if parameters:
+            queryset = filter_by_parameters(queryset, parameters)
+        # ?range=Встроенная память (Гб):256: - отбор по числовому значению параметра
+        return filter_parameter_ranges(queryset, parse_range_filters(self.request.query_params.getlist('range')))
 
     @action(methods=['POST'], detail=False, throttle_classes=[UserRateThrottle])
     def write(self, request, *args, **kwargs):
@@ -212,26 +253,123 @@ class ProductViewSet(ModelViewSet):
         shop = Shop.objects.filter(pk=request.data.get('shop'))
         name = Product.objects.filter(name=request.data.get('name'))
         if category and shop and not name:
-            Product.objects.create(
-                model=request.data.get('model'),
-                name=request.data.get('name'),
-                quantity=request.data.get('quantity'),
-                price=request.data.get('price'),
-                price_rrc=request.data.get('price_rrc'),
-                category_id=request.data.get('category'),
-                shop_id=request.data.get('shop'),
-                                   )
+            # post_save и catalog_updated пересчитывают лучшие предложения один раз
+            with deferred_offers():
+                product = Product.objects.create(
+                    model=request.data.get('model'),
+                    name=request.data.get('name'),
+                    quantity=request.data.get('quantity'),
+                    price=request.data.get('price'),
+                    price_rrc=request.data.get('price_rrc'),
+                    category_id=request.data.get('category'),
+                    shop_id=request.data.get('shop'),
+                )
+                catalog_updated.send(sender=Product, product_ids=[product.id])
             return Response({'Status': "OK"})
         else:
             return JsonResponse({'Status': False, 'Errors': 'incorrect data was transmitted'})
 
-
-class BasketViewSet(ModelViewSet):
+    # полнотекстовый поиск по названию, модели и значениям параметров: products/search/?q=...
+    @action(methods=['GET'], detail=False)
+    @cached_response
+    def search(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': 'Search query is required'})
+        product_ids = search_product_ids(query)
+        # фильтры category и shop применяются к найденным товарам, порядок релевантности сохраняется
+        matched = set(self.filter_queryset(self.get_queryset()).filter(id__in=product_ids)
+                      .values_list('id', flat=True))
+        paginator = PageNumberPagination()
+        paginator.page_size_query_param = 'page_size'
+        page = paginator.paginate_queryset([pk for pk in product_ids if pk in matched], request, view=self)
+        products = self.get_queryset().in_bulk(page)
+        serializer = self.get_serializer([products[pk] for pk in page], many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    # счетчики значений параметров: products/facets/?category=224&parameter=Цвет:черный
+    @action(methods=['GET'], detail=False)
+    @cached_response
+    def facets(self, request, *args, **kwargs):
+        filters = {}
+        for field in ('category', 'shop'):
+            value = request.query_params.get(field)
+            if value:
+                if not value.isdigit():
+                    raise ValidationError({field: 'A valid integer is required'})
+                filters[field] = int(value)
+        count, facets = facet_index.facets(
+            parameters=parse_parameter_filters(request.query_params.getlist('parameter')), **filters)
+        return Response({'count': count, 'facets': facets})
+
+    # подсказки для строки поиска из индекса в памяти, без запросов к базе: products/suggest/?q=iph
+    @action(methods=['GET'], detail=False)
+    def suggest(self, request, *args, **kwargs):
+        limit = request.query_params.get('limit', '')
+        if limit and not limit.isdigit():
+            raise ValidationError({'limit': 'A valid integer is required'})
+        limit = min(int(limit), 100) if limit else None
+        return Response({'suggestions': suggest_index.suggest(request.query_params.get('q', ''), limit)})
+
+    # сравнение цен магазинов на одну модель: products/offers/?model=apple/iphone/xr
+    @action(methods=['GET'], detail=False)
+    @cached_response
+    def offers(self, request, *args, **kwargs):
+        model = request.query_params.get('model', '').strip()
+        if not model:
+            raise ValidationError({'model': 'Product model is required'})
+        offers = [{'id': offer['product_id'], 'name': offer['product__name'], 'shop_id': offer['product__shop_id'],
+                   'shop': offer['product__shop__name'], 'price': offer['price'],
+                   'quantity': offer['product__quantity']}
+                  for offer in BestOffer.objects.filter(model=model).order_by('rank').values(
+                      'product_id', 'product__name', 'product__shop_id', 'product__shop__name', 'price',
+                      'product__quantity')]
+        return Response({'model': model, 'min_price': offers[0]['price'] if offers else None, 'offers': offers})
+
+    # товары по списку id за один запрос: products/batch/?ids=3,1,2 или POST {"ids": [3, 1, 2]}
+    @action(methods=['GET', 'POST'], detail=False)
+    def batch(self, request, *args, **kwargs):
+        if request.method == 'POST':
+            values = request.data.get('ids')
+            values = values if isinstance(values, list) else [values]
+        else:
+            values = [value for item in request.query_params.getlist('ids') for value in item.split(',') if value]
+        try:
+            ids = list(dict.fromkeys(int(value) for value in values))
+        except (TypeError, ValueError):
+            raise ValidationError({'ids': 'A list of integer ids is required'})
+        if not ids or len(ids) > settings.PRODUCT_BATCH_MAX_IDS:
+            raise ValidationError({'ids': f'From 1 to {settings.PRODUCT_BATCH_MAX_IDS} ids are required'})
+        compiled = project_for_request(compile_serializer(self.get_serializer_class()), request)
+        products = compiled.by_pk(ids)
+        # порядок запроса сохраняется, не найденные id перечисляются отдельно
+        return Response({'results': [{'id': pk, **products[pk]} for pk in ids if pk in products],
+                         'missing': [pk for pk in ids if pk not in products]})
+
+    # выгрузка всего каталога или магазина потоком: products/export/?output=csv&shop=1
+    @action(methods=['GET'], detail=False)
+    def export(self, request, *args, **kwargs):
+        # параметр format занят выбором рендерера DRF
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            raise ValidationError({'output': f'Expected one of {", ".join(EXPORT_FORMATS)}'})
+        queryset = self.filter_queryset(Product.objects.all())
+        stream = export_csv(queryset) if output == 'csv' else export_ndjson(queryset)
+        response = StreamingHttpResponse(stream, content_type=EXPORT_FORMATS[output])
+        response['Content-Disposition'] = f'attachment; filename="catalog.{output}"'
+        return response
+
+
+class BasketViewSet(CompiledListMixin, ModelViewSet):
     """
     Класс для добавления в корзину продуктов
     """
-    queryset = Basket.objects.all()
+    queryset = Basket.objects.select_related('shop', 'product__shop', 'product__category').prefetch_related(
+        Prefetch('product__product_parameters',
+                 queryset=ProductParameter.objects.select_related('parameter').order_by('id'))
+    ).order_by('id')
     serializer_class = BasketSerializer
+    cursor_ordering = 'id'
 
     def perform_create(self, serializer):
         order_shops = Shop.objects.values().filter(id=self.request.data.get('shop_id'))[0]
@@ -275,6 +413,7 @@ class OrderViewSet(ModelViewSet):
     """
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    cursor_ordering = ('-dt', 'id')
 
     # размещение заказа покупателем
     def create(self, request, *args, **kwargs):
@@ -314,7 +453,10 @@ class OrderViewSet(ModelViewSet):
                     products = Product.objects.values().filter(id=order.get('product_id'))
                     for product in products:
                         difference = product.get('quantity') - order.get('quantity')
-                        Product.objects.values().filter(id=order.get('product_id')).update(quantity=difference)
+                        Product.objects.values().filter(id=order.get('product_id')).update(
+                            quantity=difference, updated_at=timezone.now())
+                catalog_updated.send(sender=Order, product_ids=[order.get('product_id') for order in order_product],
+                                     fields=('quantity',))
                 Basket.objects.filter(user_id=self.request.user.id).delete()
 
                 # Отправляем почту покупателю
@@ -333,18 +475,38 @@ class OrderViewSet(ModelViewSet):
     def list(self, request, *args, **kwargs):
         if request.user.is_authenticated and request.user.type == 'buyer':
             order = Order.objects.filter(user_id=self.request.user.id)
-            order_sum = Order.objects.filter(user_id=self.request.user.id).aggregate(
-                total_sum_order=Sum('sum_price_product'))
-            serializer = OrderSerializer(order, many=True)
-            return Response({'Total_sum_order': order_sum.get("total_sum_order"), 'orders': serializer.data},
-                            status=status.HTTP_200_OK)
+            return self.orders_response(request, order, Q(user_id=self.request.user.id))
         elif request.user.is_authenticated and request.user.type == 'shop':
             order = Order.objects.filter(shop_id=self.request.user.id)
-            order_sum = Order.objects.filter(user_id=self.request.user.id).aggregate(
-                total_sum_order=Sum('sum_price_product'))
-            serializer = OrderSerializer(order, many=True)
-            return Response({'Total_sum_order': order_sum.get("total_sum_order"), 'orders': serializer.data},
-                            status=status.HTTP_200_OK)
+            return self.orders_response(request, order, Q(user_id=self.request.user.id))
+
+    def orders_response(self, request, order, sum_filter):
+        # сумма и валидаторы (число заказов и время последнего изменения) считаются одним
+        # запросом; на совпавший If-None-Match ответ 304 без сериализации
+        state = (order | Order.objects.filter(sum_filter)).aggregate(
+            count=Count('id'), updated_at=Max('updated_at'),
+            total_sum_order=Sum('sum_price_product', filter=sum_filter))
+        # Last-Modified с точностью до секунды, в ETag - точное время
+        last_modified = state['updated_at'] and int(state['updated_at'].timestamp())
+        etag = make_etag('orders', request.user.id, request.get_full_path(), state['count'], state['updated_at'])
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        compiled = project_for_request(compile_serializer(OrderSerializer), request)
+        # без ?pagination=cursor список заказов отдается целиком, как раньше
+        if not self.paginator.is_keyset_request(request):
+            response = Response({'Total_sum_order': state['total_sum_order'],
+                                 'orders': compiled.serialize(compiled.values(order))},
+                                status=status.HTTP_200_OK)
+        else:
+            page = self.paginate_queryset(compiled.values(order, ordering_columns(self)))
+            response = Response({'Total_sum_order': state['total_sum_order'],
+                                 'next': self.paginator.keyset.get_next_link(),
+                                 'previous': self.paginator.keyset.get_previous_link(),
+                                 'orders': compiled.serialize(page)},
+                                status=status.HTTP_200_OK)
+        return set_validators(response, etag, last_modified)
 
     # обновление статуса заказа магазином
     def perform_update(self, serializer):
@@ -368,13 +530,15 @@ class OrderViewSet(ModelViewSet):
 
     # просмотр заказа покупателем/продавцом
     def retrieve(self, request, *args, **kwargs):
+        # OrderItemSerializer выводит contact и product (вместе с магазином) строками
+        items = Order.objects.select_related('contact', 'product__shop')
         if request.user.is_authenticated and request.user.type == 'buyer':
-            order = Order.objects.filter(user_id=self.request.user.id).\
+            order = items.filter(user_id=self.request.user.id).\
                 filter(id=self.request.parser_context.get('kwargs').get('pk'))
             serializer = OrderItemSerializer(order, many=True)
             return Response({'orders': serializer.data}, status=status.HTTP_200_OK)
         elif request.user.is_authenticated and request.user.type == 'shop':
-            order = Order.objects.filter(shop_id=self.request.user.id).\
+            order = items.filter(shop_id=self.request.user.id).\
                 filter(id=self.request.parser_context.get('kwargs').get('pk'))
             serializer = OrderItemSerializer(order, many=True)
             return Response({'orders': serializer.data}, status=status.HTTP_200_OK)
@@ -382,20 +546,26 @@ class OrderViewSet(ModelViewSet):
 
 class PartnerUpdate(APIView):
     """
-    Класс для обновления прайса от поставщика
+    Класс для обновления прайса от поставщика (импорт выполняется в фоне)
     """
-    serializer_class = ProductSerializer
+    serializer_class = ImportRunSerializer
+
     def shop_data_post(self, request, *args, **kwargs):
         url = request.data.get('url')
         if url:
             validate_url = URLValidator()
             try:
                 validate_url(url)
-            except ValidationError as e:
+            except DjangoValidationError as e:
                 return JsonResponse({'Status': False, 'Error': str(e)})
             else:
-                data = shop_data_task(url)
-            return data
+                feed_format = request.data.get('format', '')
+                if feed_format and feed_format not in dict(FEED_FORMAT_CHOICES):
+                    return JsonResponse({'Status': False, 'Error': f'Unsupported format {feed_format}'})
+                import_run = ImportRun.objects.create(user_id=request.user.id, url=url, feed_format=feed_format)
+                fetch_feeds_task.delay([import_run.id])
+                return JsonResponse({'Status': True, 'Task': import_run.id}, status=202)
+        return JsonResponse({'Status': False, 'Errors': 'All necessary arguments are not specified'})
 
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
@@ -403,28 +573,45 @@ class PartnerUpdate(APIView):
 
         if request.user.type != 'shop':
             return JsonResponse({'Status': False, 'Error': 'Only for stores'}, status=403)
-        data = self.shop_data_post(request, *args, **kwargs)
-        shop, _ = Shop.objects.get_or_create(name=data.get('shop'), user_id=request.user.id)
-        try:
-            for category in data.get('categories'):
-                category_object, _ = Category.objects.get_or_create(id=category['id'], name=category.get('name'))
-            for item in data.get('goods'):
-                product, _ = Product.objects.get_or_create(model=item.get('model'),
-                                                           name=item.get('name'),
-                                                           quantity=item.get('quantity'),
-                                                           price=item.get('price'),
-                                                           price_rrc=item.get('price_rrc'),
-                                                           category_id=item.get('category'),
-                                                           shop_id=shop.id,
-                                                           )
-
-                for name, value in item.get('parameters').items():
-                    product_parameter, _ = ProductParameter.objects.get_or_create(name=name,
-                                                                                  value=value,
-                                                                                  product_id=product.id)
-        except IntegrityError as error:
-            raise PermissionDenied(error)
-        return JsonResponse({'Status': True})
+        return self.shop_data_post(request, *args, **kwargs)
+
+
+class PartnerUpdateStatus(APIView):
+    """
+    Класс для просмотра хода импорта прайса
+    """
+    serializer_class = ImportRunSerializer
+
+    def get(self, request, pk, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
+        import_run = ImportRun.objects.filter(pk=pk, user_id=request.user.id).first()
+        if not import_run:
+            return JsonResponse({'Status': False, 'Error': 'Import not found'}, status=404)
+        return Response(ImportRunSerializer(import_run).data)
+
+
+class PartnerStock(APIView):
+    """
+    Класс для быстрого обновления остатков и цен поставщика без полного импорта прайса
+    """
+    parser_classes = [JSONParser, CsvDeltaParser]
+
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
+
+        if request.user.type != 'shop':
+            return JsonResponse({'Status': False, 'Error': 'Only for stores'}, status=403)
+        shop = Shop.objects.filter(user_id=request.user.id).first()
+        if not shop:
+            return JsonResponse({'Status': False, 'Error': 'Shop not found'}, status=404)
+
+        rows = request.data.get('items') if isinstance(request.data, dict) else request.data
+        if not isinstance(rows, list):
+            return JsonResponse({'Status': False, 'Errors': 'All necessary arguments are not specified'})
+        updated, missing = apply_stock_delta(shop, parse_delta(rows))
+        return JsonResponse({'Status': True, 'Updated': updated, 'Missing': missing})
 
 
 class ContactView(APIView):
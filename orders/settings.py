@@ -114,6 +114,25 @@ DATABASES = {
     }
 }
 
+# локальный запуск без Postgres (например, для manage.py benchmark_import): ORDERS_DB=sqlite
+if os.environ.get('ORDERS_DB') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        }
+    }
+
+# Кеш Django: по умолчанию в памяти процесса (LocMem), в продакшене - общий Redis:
+# CACHE_REDIS_URL=redis://localhost:6379/1
+if os.environ.get('CACHE_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.environ['CACHE_REDIS_URL'],
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -166,7 +185,7 @@ EMAIL_USE_SSL = True
 SERVER_EMAIL = EMAIL_HOST_USER
 
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'backend.pagination.OptionalKeysetPagination',
     'PAGE_SIZE': 40,
 
     'DEFAULT_RENDERER_CLASSES': (
@@ -219,6 +238,93 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
 
+# Скачивание прайсов идет в отдельной очереди, чтобы ожидание сети не занимало процессы импорта
+CELERY_TASK_ROUTES = {
+    'backend.tasks.fetch_feeds_task': {'queue': 'feeds'},
+}
+
+# Периодическая синхронизация прайсов магазинов по Shop.url (celery beat)
+FEED_SYNC_INTERVAL = 60 * 60
+FEED_SYNC_MAX_IMPORTS = 4
+FEED_SYNC_RETRY_DELAY = 30
+# Место импорта освобождается само, если пакет товаров не обрабатывался столько секунд (процесс упал)
+FEED_IMPORT_TIMEOUT = 15 * 60
+
+# Redis возвращает в очередь задачи, не подтвержденные за visibility_timeout, поэтому он должен
+# превышать наибольшую отсрочку задачи (до FEED_SYNC_INTERVAL), иначе синхронизация выполнится дважды
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 2 * FEED_SYNC_INTERVAL}
+
+CELERY_BEAT_SCHEDULE = {
+    'schedule-feed-sync': {
+        'task': 'backend.tasks.schedule_feed_sync_task',
+        'schedule': FEED_SYNC_INTERVAL,
+    },
+}
+
+# Размер пакета при импорте прайса поставщика
+PARTNER_IMPORT_CHUNK_SIZE = 1000
+
+# Размер пакета строк при обновлении остатков и цен (partner/stock/)
+PARTNER_DELTA_BATCH_SIZE = 500
+
+# Сколько самых дешевых предложений в наличии хранится на модель товара (products/offers/)
+BEST_OFFERS_TOP_K = 5
+
+# Наибольшее число id в одном запросе products/batch/
+PRODUCT_BATCH_MAX_IDS = 100
+
+# Размер пакета товаров при потоковой выгрузке каталога (products/export/)
+CATALOG_EXPORT_CHUNK_SIZE = 2000
+
+# Полнотекстовый поиск товаров (products/search/): конфигурация текстового поиска Postgres
+# и максимальное количество ранжированных результатов
+PRODUCT_SEARCH_CONFIG = 'russian'
+PRODUCT_SEARCH_LIMIT = 1000
+
+# Фасетный индекс товаров (products/facets/): журнал изменений каталога хранится в кеше Django,
+# при нескольких процессах кеш должен быть общим (Redis). Если процесс отстал больше чем на
+# FACET_LOG_MAX_ENTRIES записей, его индекс строится заново
+FACET_LOG_MAX_ENTRIES = 1000
+FACET_LOG_TIMEOUT = 24 * 3600
+
+# Если фильтр по параметрам подходит больше чем FACET_FILTER_MAX_IDS товарам, список товаров
+# отбирается подзапросом по таблице параметров, а не списком id из индекса
+FACET_FILTER_MAX_IDS = 500
+
+# Подсказки поиска (products/suggest/): индекс в памяти процесса загружается из снимка в кеше
+# и дочитывает журнал изменений так же, как фасетный индекс; снимок перезаписывается, когда после
+# него накопилось SUGGEST_SNAPSHOT_INTERVAL записей журнала. SUGGEST_SCAN_FACTOR ограничивает
+# число просматриваемых ключей (limit * SUGGEST_SCAN_FACTOR) для коротких префиксов. До
+# SUGGEST_INSORT_LIMIT измененных ключей вставляются по одному, больше - слиянием с одной сортировкой
+SUGGEST_LIMIT = 10
+SUGGEST_SCAN_FACTOR = 20
+SUGGEST_LOG_MAX_ENTRIES = 1000
+SUGGEST_LOG_TIMEOUT = 24 * 3600
+SUGGEST_SNAPSHOT_TIMEOUT = 24 * 3600
+SUGGEST_SNAPSHOT_INTERVAL = 100
+SUGGEST_INSORT_LIMIT = 64
+
+# Время жизни закешированных ответов каталога (категории, магазины, товары), секунды.
+# Кеш сбрасывается сменой версии при изменении каталога, срок нужен только для вытеснения
+CATALOG_CACHE_TIMEOUT = 600
+
+# Защита от одновременного пересчета: пока один запрос заново строит ответ, остальные
+# получают прошлую версию ответа (хранится CATALOG_CACHE_STALE_TIMEOUT) или ждут до
+# CATALOG_CACHE_WAIT секунд. Блокировка в общем кеше снимается сама через CATALOG_CACHE_LOCK_TIMEOUT
+CATALOG_CACHE_STALE_TIMEOUT = 24 * 3600
+CATALOG_CACHE_WAIT = 5
+CATALOG_CACHE_LOCK_TIMEOUT = 30
+CATALOG_CACHE_POLL_INTERVAL = 0.05
+
+# Скачивание прайсов поставщиков
+FEED_CACHE_DIR = os.path.join(BASE_DIR, 'feed_cache')
+FEED_CONNECT_TIMEOUT = 5
+FEED_READ_TIMEOUT = 30
+FEED_MAX_SIZE = 200 * 1024 * 1024
+FEED_POOL_SIZE = 10
+FEED_FETCH_WORKERS = 20
+FEED_FETCH_PER_HOST = 4
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'backend API',
     'DESCRIPTION': 'backend API',